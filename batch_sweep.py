@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+パラメータスイープのバッチ計算とコンタクトシート描画
+数千通りの変換行列と出力サイズをnumpyの一括演算で求め、縮小版を並列にワープして一枚の画像に並べる
+"""
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import image_cache
+import transform_core
+
+
+# スイープ可能なパラメータ（transform_core.build_individual_matrices の引数）
+PARAM_NAMES = ('sx', 'sy', 'angle_deg', 'hx', 'hy')
+PARAM_DEFAULTS = {'sx': 1.0, 'sy': 1.0, 'angle_deg': 0.0, 'hx': 0.0, 'hy': 0.0}
+
+
+# ================================================================
+# パラメータグリッド
+# ================================================================
+
+def make_grid(**values):
+    """指定したパラメータ軸の直積グリッドを作成（未指定は既定値）。各値は (N,) の平坦な配列"""
+    unknown = set(values) - set(PARAM_NAMES)
+    if unknown:
+        raise ValueError(f"不明なパラメータ: {sorted(unknown)}")
+    axes = [np.atleast_1d(np.asarray(values.get(k, PARAM_DEFAULTS[k]), dtype=float))
+            for k in PARAM_NAMES]
+    mesh = np.meshgrid(*axes, indexing='ij')
+    return {k: m.ravel() for k, m in zip(PARAM_NAMES, mesh)}
+
+
+# ================================================================
+# 行列の一括構築
+# ================================================================
+
+def build_individual_matrices_batch(sx=1.0, sy=1.0, angle_deg=0.0, hx=0.0, hy=0.0):
+    """各変換の3x3行列を (N, 3, 3) でまとめて構築"""
+    sx, sy, angle_deg, hx, hy = (
+        a.ravel() for a in np.broadcast_arrays(
+            *(np.asarray(v, dtype=float) for v in (sx, sy, angle_deg, hx, hy))))
+    n = sx.size
+
+    a = np.radians(angle_deg)
+    c, s = np.cos(a), np.sin(a)
+
+    scale = np.zeros((n, 3, 3))
+    scale[:, 0, 0] = sx
+    scale[:, 1, 1] = sy
+    scale[:, 2, 2] = 1
+
+    rotation = np.zeros((n, 3, 3))
+    rotation[:, 0, 0] = c
+    rotation[:, 0, 1] = -s
+    rotation[:, 1, 0] = s
+    rotation[:, 1, 1] = c
+    rotation[:, 2, 2] = 1
+
+    shear = np.tile(np.eye(3), (n, 1, 1))
+    shear[:, 0, 1] = hx
+    shear[:, 1, 0] = hy
+
+    return {'scale': scale, 'rotation': rotation, 'shear': shear}
+
+
+def compose_batch(matrices, order=transform_core.DEFAULT_ORDER):
+    """適用順序に従って (N, 3, 3) 行列を合成（先頭が最初に適用）"""
+    combined = None
+    for key in order:
+        combined = matrices[key] if combined is None else matrices[key] @ combined
+    return combined
+
+
+def centered_batch(linear, w, h):
+    """画像中心を原点として変換する完全な行列を (N, 3, 3) で返す"""
+    cx, cy = w / 2.0, h / 2.0
+    to_origin = np.array([[1, 0, -cx], [0, 1, -cy], [0, 0, 1]])
+    from_origin = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]])
+    return from_origin @ linear @ to_origin
+
+
+def compute_output_bounds_batch(w, h, combined_linear):
+    """compute_output_bounds の一括版。各要素が (N,) 配列の (out_w, out_h, min_x, min_y) を返す"""
+    corners = np.array([
+        [0, 0, 1],
+        [w, 0, 1],
+        [w, h, 1],
+        [0, h, 1]
+    ], dtype=float).T  # 3x4
+
+    transformed = combined_linear @ corners  # Nx3x4
+    xs = transformed[:, 0]
+    ys = transformed[:, 1]
+
+    pad = max(w, h) * 0.25
+    min_x = xs.min(axis=1) - pad
+    min_y = ys.min(axis=1) - pad
+    max_x = xs.max(axis=1) + pad
+    max_y = ys.max(axis=1) + pad
+
+    out_w = np.ceil(max_x - min_x).astype(int)
+    out_h = np.ceil(max_y - min_y).astype(int)
+
+    return out_w, out_h, min_x, min_y
+
+
+def build_transform_batch(w, h, params, order=transform_core.DEFAULT_ORDER):
+    """パラメータ配列から最終変換行列 (N, 3, 3) と出力サイズ (N,) を一括計算"""
+    matrices = build_individual_matrices_batch(
+        **{k: params.get(k, PARAM_DEFAULTS[k]) for k in PARAM_NAMES})
+    full = centered_batch(compose_batch(matrices, order), w, h)
+    out_w, out_h, min_x, min_y = compute_output_bounds_batch(w, h, full)
+
+    offset = np.tile(np.eye(3), (len(full), 1, 1))
+    offset[:, 0, 2] = -min_x
+    offset[:, 1, 2] = -min_y
+    return offset @ full, out_w, out_h
+
+
+# ================================================================
+# コンタクトシート
+# ================================================================
+
+def _label_text(params, i, keys):
+    return " ".join(f"{k}={params[k][i]:g}" for k in keys)
+
+
+def render_contact_sheet(image, params, order=transform_core.DEFAULT_ORDER,
+                         cell_size=160, columns=None, workers=None):
+    """各パラメータの縮小版を並列にワープし、パラメータ付きで一枚のRGBA画像に並べる"""
+    import cv2
+
+    # シートは8bitなので、16bit・浮動小数の画像は縮小の前に一度だけ8bitにする
+    image = transform_core.preview_proxy(image)
+    h, w = image.shape[:2]
+    finals, out_w, out_h = build_transform_batch(w, h, params, order)
+    n = len(finals)
+    if columns is None:
+        columns = int(np.ceil(np.sqrt(n)))
+    rows = int(np.ceil(n / columns))
+
+    # 各セルに収まる縮小率
+    fit = cell_size / np.maximum(out_w, out_h)
+
+    # 元画像は最大の必要解像度まで一度だけ縮小して全セルで共有
+    linear_norm = np.linalg.norm(finals[:, :2, :2], ord=2, axis=(1, 2))
+    src_scale = min(1.0, float((fit * linear_norm).max()))
+    if src_scale < 1.0:
+        src = cv2.resize(image, (max(1, int(round(w * src_scale))),
+                                 max(1, int(round(h * src_scale)))),
+                         interpolation=cv2.INTER_AREA)
+        src_scale_x = src.shape[1] / w
+        src_scale_y = src.shape[0] / h
+    else:
+        src = image
+        src_scale_x = src_scale_y = 1.0
+    from_src = np.diag([1 / src_scale_x, 1 / src_scale_y, 1.0])
+
+    # 値が変化するパラメータだけをラベルに表示
+    varying = [k for k in PARAM_NAMES
+               if k in params and np.unique(np.asarray(params[k])).size > 1]
+    keys = varying or [k for k in PARAM_NAMES if k in params]
+    full_params = {k: np.broadcast_to(np.asarray(params.get(k, PARAM_DEFAULTS[k]), dtype=float), (n,))
+                   for k in PARAM_NAMES}
+
+    label_h = 16
+    sheet = np.zeros((rows * (cell_size + label_h), columns * cell_size, 4), dtype=np.uint8)
+
+    def render_cell(i):
+        f = fit[i]
+        cw = max(1, int(round(out_w[i] * f)))
+        ch = max(1, int(round(out_h[i] * f)))
+        m = np.diag([f, f, 1.0]) @ finals[i] @ from_src
+
+        tile = np.zeros((cell_size + label_h, cell_size, 4), dtype=np.uint8)
+        oy = (cell_size - ch) // 2
+        ox = (cell_size - cw) // 2
+        tile[oy:oy + ch, ox:ox + cw] = transform_core.warp_rgba(src, m, cw, ch)
+
+        # ラベル帯
+        tile[cell_size:] = (30, 30, 30, 255)
+        cv2.putText(tile, _label_text(full_params, i, keys), (3, cell_size + label_h - 4),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.3, (255, 255, 255, 255), 1, cv2.LINE_AA)
+
+        r, c = divmod(i, columns)
+        y0 = r * (cell_size + label_h)
+        x0 = c * cell_size
+        sheet[y0:y0 + cell_size + label_h, x0:x0 + cell_size] = tile
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(render_cell, range(n)))
+
+    return sheet
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+
+def _parse_range(text):
+    """'start:stop:num' を等間隔の配列に、単一値はそのまま配列に変換"""
+    parts = text.split(':')
+    if len(parts) == 1:
+        return np.array([float(parts[0])])
+    if len(parts) != 3:
+        raise argparse.ArgumentTypeError("start:stop:num の形式で指定してください")
+    return np.linspace(float(parts[0]), float(parts[1]), int(parts[2]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="パラメータスイープのコンタクトシートを作成")
+    parser.add_argument('image', help="入力画像")
+    parser.add_argument('-o', '--output', default='contact_sheet.png', help="出力画像")
+    parser.add_argument('--scale-x', type=_parse_range, dest='sx')
+    parser.add_argument('--scale-y', type=_parse_range, dest='sy')
+    parser.add_argument('--rotation', type=_parse_range, dest='angle_deg')
+    parser.add_argument('--shear-x', type=_parse_range, dest='hx')
+    parser.add_argument('--shear-y', type=_parse_range, dest='hy')
+    parser.add_argument('--order', default=','.join(transform_core.DEFAULT_ORDER),
+                        help="適用順序（カンマ区切り）")
+    parser.add_argument('--cell-size', type=int, default=160)
+    parser.add_argument('--columns', type=int)
+    parser.add_argument('--workers', type=int)
+    image_cache.add_arguments(parser)
+    args = parser.parse_args()
+
+    import cv2
+
+    try:
+        image = image_cache.read_image(args.image, image_cache.from_args(args))
+    except ValueError as e:
+        raise SystemExit(f"{e}: {args.image}")
+
+    params = make_grid(**{k: getattr(args, k) for k in PARAM_NAMES
+                          if getattr(args, k) is not None})
+    order = [k.strip() for k in args.order.split(',')]
+    sheet = render_contact_sheet(image, params, order, cell_size=args.cell_size,
+                                 columns=args.columns, workers=args.workers)
+    cv2.imwrite(args.output, cv2.cvtColor(sheet, cv2.COLOR_RGBA2BGRA))
+    print(f"コンタクトシートを保存しました: {args.output}（{len(params['sx'])} 通り）")
+
+
+if __name__ == "__main__":
+    main()
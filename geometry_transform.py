@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+アノテーション（点・矩形・ポリゴン）の一括座標変換
+画像のワープと同じ最終変換行列（中心化とオフセット込み）を (N, 2) 配列にチャンク単位で適用する
+
+座標はcv2.warpAffineと同じ画素インデックス基準（画素中心が整数座標）で扱うため、
+変換結果はワープ後の画像の画素位置と一致する
+"""
+
+import argparse
+import csv
+import json
+
+import numpy as np
+
+import transform_core
+
+
+# 1チャンクあたりの点数（中間配列のメモリを抑える）
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+# ================================================================
+# 点の変換
+# ================================================================
+
+def transform_points(points, matrix, chunk_size=DEFAULT_CHUNK_SIZE, out=None):
+    """(N, 2) の点列に3x3（または2x3）アフィン行列をチャンク単位で適用"""
+    points = np.asarray(points, dtype=float)
+    if points.ndim != 2 or points.shape[1] != 2:
+        raise ValueError("点列は (N, 2) の配列で指定してください")
+    matrix = np.asarray(matrix, dtype=float)
+    linear_t = matrix[:2, :2].T
+    shift = matrix[:2, 2]
+
+    if out is None:
+        out = np.empty_like(points)
+    for start in range(0, len(points), chunk_size):
+        stop = start + chunk_size
+        np.matmul(points[start:stop], linear_t, out=out[start:stop])
+        out[start:stop] += shift
+    return out
+
+
+def invert(matrix):
+    """アフィン行列の逆行列（3x3）を返す"""
+    matrix = np.asarray(matrix, dtype=float)
+    full = np.eye(3)
+    full[:2, :] = matrix[:2, :]
+    return np.linalg.inv(full)
+
+
+def inverse_transform_points(points, matrix, chunk_size=DEFAULT_CHUNK_SIZE, out=None):
+    """変換後の座標（画面クリックなど）を元画像の座標に戻す"""
+    return transform_points(points, invert(matrix), chunk_size, out)
+
+
+# ================================================================
+# 矩形・ポリゴン
+# ================================================================
+
+def transform_boxes(boxes, matrix, chunk_size=DEFAULT_CHUNK_SIZE):
+    """(N, 4) の軸平行矩形 [x0, y0, x1, y1] を変換し、四隅を包む軸平行矩形に当てはめ直す"""
+    boxes = np.asarray(boxes, dtype=float)
+    if boxes.ndim != 2 or boxes.shape[1] != 4:
+        raise ValueError("矩形は (N, 4) の配列で指定してください")
+    out = np.empty_like(boxes)
+    step = max(1, chunk_size // 4)
+    for start in range(0, len(boxes), step):
+        b = boxes[start:start + step]
+        corners = np.stack([
+            b[:, [0, 1]], b[:, [2, 1]], b[:, [2, 3]], b[:, [0, 3]]
+        ], axis=1).reshape(-1, 2)
+        t = transform_points(corners, matrix, chunk_size).reshape(-1, 4, 2)
+        out[start:start + step, :2] = t.min(axis=1)
+        out[start:start + step, 2:] = t.max(axis=1)
+    return out
+
+
+def transform_polygons(polygons, matrix, chunk_size=DEFAULT_CHUNK_SIZE):
+    """頂点数の異なるポリゴンのリストを一度の点変換でまとめて変換"""
+    polygons = [np.asarray(p, dtype=float).reshape(-1, 2) for p in polygons]
+    if not polygons:
+        return []
+    flat = transform_points(np.concatenate(polygons), matrix, chunk_size)
+    splits = np.cumsum([len(p) for p in polygons])[:-1]
+    return np.split(flat, splits)
+
+
+# ================================================================
+# ストリーミング入力
+# ================================================================
+
+def transform_csv(in_path, out_path, matrix, chunk_size=DEFAULT_CHUNK_SIZE, x_col=0, y_col=1):
+    """CSVの x, y 列をチャンク単位で変換して書き出す（他の列とヘッダーはそのまま）"""
+    count = 0
+    with open(in_path, newline='') as fin, open(out_path, 'w', newline='') as fout:
+        reader = csv.reader(fin)
+        writer = csv.writer(fout)
+        rows = []
+
+        def flush():
+            if not rows:
+                return 0
+            pts = np.array([[float(r[x_col]), float(r[y_col])] for r in rows])
+            transform_points(pts, matrix, chunk_size, out=pts)
+            for r, (x, y) in zip(rows, pts):
+                r[x_col] = repr(float(x))
+                r[y_col] = repr(float(y))
+            writer.writerows(rows)
+            n = len(rows)
+            rows.clear()
+            return n
+
+        for i, row in enumerate(reader):
+            if i == 0 and not _is_number(row[x_col]):
+                writer.writerow(row)  # ヘッダー
+                continue
+            rows.append(row)
+            if len(rows) >= chunk_size:
+                count += flush()
+        count += flush()
+    return count
+
+
+def transform_jsonl(in_path, out_path, matrix, chunk_size=DEFAULT_CHUNK_SIZE):
+    """JSON Linesのアノテーションを変換して書き出す
+
+    各行の 'points'（点列）、'polygon'（ポリゴン）、'bbox'（[x0, y0, x1, y1]）を変換し、
+    他のキーはそのまま残す。複数行の座標をまとめて一度に変換する
+    """
+    count = 0
+    with open(in_path) as fin, open(out_path, 'w') as fout:
+        records = []
+        n_points = 0
+
+        def flush():
+            if not records:
+                return 0
+            polys = []
+            boxes = []
+            for rec in records:
+                for key in ('points', 'polygon'):
+                    if key in rec:
+                        polys.append(rec[key])
+                if 'bbox' in rec:
+                    boxes.append(rec['bbox'])
+            polys = iter(transform_polygons(polys, matrix, chunk_size))
+            boxes = iter(transform_boxes(np.reshape(boxes, (-1, 4)), matrix, chunk_size))
+            for rec in records:
+                for key in ('points', 'polygon'):
+                    if key in rec:
+                        rec[key] = next(polys).tolist()
+                if 'bbox' in rec:
+                    rec['bbox'] = next(boxes).tolist()
+                fout.write(json.dumps(rec, ensure_ascii=False) + "\n")
+            n = len(records)
+            records.clear()
+            return n
+
+        for line in fin:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            records.append(rec)
+            n_points += len(rec.get('points', ())) + len(rec.get('polygon', ())) + \
+                4 * ('bbox' in rec)
+            if n_points >= chunk_size:
+                count += flush()
+                n_points = 0
+        count += flush()
+    return count
+
+
+def _is_number(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="画像と同じ変換をアノテーション座標（CSV / JSON Lines）に適用")
+    parser.add_argument('input', help="入力ファイル（.csv または .jsonl）")
+    parser.add_argument('output', help="出力ファイル")
+    parser.add_argument('--size', type=int, nargs=2, metavar=('W', 'H'), required=True,
+                        help="元画像のサイズ（中心化と出力オフセットの計算に使用）")
+    parser.add_argument('--scale-x', type=float, default=1.0, dest='sx')
+    parser.add_argument('--scale-y', type=float, default=1.0, dest='sy')
+    parser.add_argument('--rotation', type=float, default=0.0, dest='angle_deg')
+    parser.add_argument('--shear-x', type=float, default=0.0, dest='hx')
+    parser.add_argument('--shear-y', type=float, default=0.0, dest='hy')
+    parser.add_argument('--order', default=','.join(transform_core.DEFAULT_ORDER),
+                        help="適用順序（カンマ区切り）")
+    parser.add_argument('--inverse', action='store_true',
+                        help="変換後の座標を元画像の座標に戻す")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    w, h = args.size
+    matrices = transform_core.build_individual_matrices(
+        args.sx, args.sy, args.angle_deg, args.hx, args.hy)
+    order = [k.strip() for k in args.order.split(',')]
+    matrix, _, _ = transform_core.build_transform(w, h, matrices, order)
+    if args.inverse:
+        matrix = invert(matrix)
+
+    if args.input.endswith('.csv'):
+        n = transform_csv(args.input, args.output, matrix, args.chunk_size)
+    else:
+        n = transform_jsonl(args.input, args.output, matrix, args.chunk_size)
+    print(f"{n} 件を変換しました: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
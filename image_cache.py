@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+デコード済み画像のディスクキャッシュ（オプトイン）
+デコード結果を生の .npy で保存し、再オープン時はデコードせずメモリマップする。
+ページはOSのページキャッシュ経由でGUIとバッチ処理のプロセス間で共有される
+"""
+
+import hashlib
+import os
+import shutil
+import time
+
+import numpy as np
+
+import transform_core
+
+
+DEFAULT_MAX_BYTES = 4 << 30  # 4 GiB
+
+
+class ImageCache:
+    """パス・ファイルサイズ・更新時刻をキーにしたLRUキャッシュ
+
+    各エントリは <key>/ ディレクトリで、0.npy に本体、1.npy 以降にピラミッドの各レベルを置く。
+    ディレクトリの更新時刻を最終アクセス時刻として使い、容量を超えたら古い順に削除する
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def key(self, path):
+        """パス・サイズ・mtimeから一意なキーを作る（ファイルが変わればキーも変わる）"""
+        st = os.stat(path)
+        ident = f"{os.path.abspath(path)}\0{st.st_size}\0{st.st_mtime_ns}"
+        return hashlib.sha1(ident.encode('utf-8')).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, path):
+        """キャッシュ済みなら (画像, [ピラミッドレベル...]) を読み取り専用のメモリマップで返す"""
+        entry = self._entry_dir(self.key(path))
+        try:
+            image = np.load(os.path.join(entry, '0.npy'), mmap_mode='r').view(np.ndarray)
+            levels = []
+            while True:
+                level_path = os.path.join(entry, f'{len(levels) + 1}.npy')
+                if not os.path.exists(level_path):
+                    break
+                levels.append(np.load(level_path, mmap_mode='r').view(np.ndarray))
+            os.utime(entry)  # LRU用のアクセス時刻
+        except (FileNotFoundError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return image, levels
+
+    def put(self, path, image, levels=()):
+        """デコード済み画像（とピラミッドレベル）を保存し、容量超過分を追い出す"""
+        key = self.key(path)
+        entry = self._entry_dir(key)
+        tmp = f"{entry}.tmp-{os.getpid()}-{time.monotonic_ns()}"
+        os.makedirs(tmp)
+        try:
+            for i, arr in enumerate([image, *levels]):
+                np.save(os.path.join(tmp, f'{i}.npy'), np.ascontiguousarray(arr))
+            try:
+                os.rename(tmp, entry)
+            except OSError:
+                # 既存エントリを退避してから置き換える（マップ中のプロセスは影響を受けない）
+                old = f"{tmp}.old"
+                try:
+                    os.rename(entry, old)
+                    os.rename(tmp, entry)
+                except OSError:
+                    shutil.rmtree(tmp, ignore_errors=True)
+                shutil.rmtree(old, ignore_errors=True)
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        self.evict()
+
+    def load(self, path, decode=transform_core.read_image):
+        """キャッシュがあればメモリマップ、なければデコードして保存した上で画像を返す"""
+        cached = self.get(path)
+        if cached is not None:
+            return cached[0]
+        image = decode(path)
+        self.put(path, image)
+        return image
+
+    def entries(self):
+        """(最終アクセス時刻, バイト数, パス) のリストを返す（作成途中のエントリは除く）"""
+        result = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            if '.tmp-' in name or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                result.append((os.path.getmtime(entry), size, entry))
+            except FileNotFoundError:
+                continue  # 他プロセスが削除中
+        return result
+
+    def evict(self):
+        """合計サイズが上限以下になるまで最終アクセスの古いエントリから削除"""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            # 既にマップしているプロセスはunlink後も読み続けられる
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """すべてのエントリを削除"""
+        for _, _, entry in self.entries():
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+# GUI とバッチ処理で同じオプションを使い、同じキャッシュを共有する
+
+def add_arguments(parser):
+    """--image-cache / --image-cache-size を argparse のパーサーに追加"""
+    parser.add_argument('--image-cache', metavar='DIR',
+                        help="デコード済み画像をキャッシュするディレクトリ（指定時のみ有効）")
+    parser.add_argument('--image-cache-size', type=int, metavar='MB',
+                        default=DEFAULT_MAX_BYTES >> 20,
+                        help="キャッシュの上限サイズ（MB）")
+
+
+def from_args(args):
+    """add_arguments で追加したオプションからキャッシュを作る（未指定なら None）"""
+    if not args.image_cache:
+        return None
+    return ImageCache(args.image_cache, args.image_cache_size << 20)
+
+
+def read_image(path, cache=None):
+    """cache があれば経由して、なければ直接画像を読み込む"""
+    if cache is None:
+        return transform_core.read_image(path)
+    return cache.load(path)
@@ -4,17 +4,51 @@
 線形変換やその他の変換を行列ベースで自由に適用できるソフトウェア
 """
 
+import argparse
+import os
+import time
+
+# 起動時間計測の基準（重いimportより前に記録）
+_STARTUP_T0 = time.perf_counter()
+
+import threading
 import tkinter as tk
-from tkinter import ttk, filedialog, messagebox
+from tkinter import filedialog, messagebox
 import numpy as np
-from PIL import Image, ImageTk, ImageDraw
-import cv2
 import math
-import re
+
+import geometry_transform
+import image_cache
+import memory_governor
+import multi_export
+import post_filters
+import speculative_render
+import transform_core
+
+
+def _preload_heavy_modules():
+    """OpenCVとPILをバックグラウンドで読み込む（初回使用時の待ちを減らす）"""
+    import cv2  # noqa: F401
+    from PIL import Image, ImageTk  # noqa: F401
 
 
 class ImageTransformGUI:
-    def __init__(self, root):
+    # 各スライダーの範囲と刻み（tk.Scale の from_, to, resolution）
+    SLIDER_RANGES = {
+        'scale_x': {'from_': 0.1, 'to': 3.0, 'resolution': 0.05},
+        'scale_y': {'from_': 0.1, 'to': 3.0, 'resolution': 0.05},
+        'rotation': {'from_': -180, 'to': 180, 'resolution': 1},
+        'shear_x': {'from_': -2.0, 'to': 2.0, 'resolution': 0.05},
+        'shear_y': {'from_': -2.0, 'to': 2.0, 'resolution': 0.05},
+    }
+    # 回転のプリセット角度
+    ROTATION_PRESETS = (90, 120, 180, 270)
+    # キャンバスの背景色（不透明な画像のプレビューはこの色の上に直接描く）
+    CANVAS_BG = '#1e1e1e'
+    CANVAS_BG_RGB = (0x1e, 0x1e, 0x1e)
+
+    def __init__(self, root, image_cache=None, recorder=None, governor=None,
+                 export_profiles=None, speculator=None, filters=None):
         self.root = root
         self.root.title("画像行列変換ツール - Matrix Transform Studio")
         self.root.geometry("1500x900")
@@ -22,9 +56,13 @@ class ImageTransformGUI:
 
         # 変数の初期化
         self.original_image = None
+        # プレビュー描画用の8bit画像（読み込み時に一度だけ作る。8bitの画像なら original_image と同じ）
+        self.preview_source = None
         self.current_image = None
         self.display_image = None
         self.image_path = None
+        # デコード済み画像のディスクキャッシュ（Noneなら無効）
+        self.image_cache = image_cache
 
         # 変換順序の管理: リストの順番＝適用順（先頭が最初に適用）
         self.transform_order = ['scale', 'rotation', 'shear']
@@ -36,6 +74,19 @@ class ImageTransformGUI:
             'shear': np.eye(3),
         }
         self.transform_matrix = np.eye(3)  # 合成結果
+        # 「行列を直接適用」で置き換えた2x3行列（3x3で保持。スライダーの変換に戻ればNone）
+        self.custom_matrix = None
+
+        # 出力メモリの管理: フル解像度の出力サイズとプレビューの縮小率
+        self.governor = governor or memory_governor.MemoryGovernor()
+        self.output_size = None
+        self.preview_scale = 1.0
+        # 次の状態の先読み描画（Noneなら無効）
+        self.speculator = speculator
+        # 「複数サイズで書き出し」のプロファイル
+        self.export_profiles = export_profiles or multi_export.DEFAULT_PROFILES
+        # ワープ後のフィルタチェーン（post_filters.FilterChain、Noneならフィルタなし）
+        self.filters = filters
 
         # ビューポート制御
         self.view_offset_x = 0
@@ -43,16 +94,51 @@ class ImageTransformGUI:
         self.view_zoom = 1.0
         self.drag_start_x = 0
         self.drag_start_y = 0
+        # 表示中の画像の配置 (x, y, 横倍率, 縦倍率)。画面座標→元画像座標の逆算に使用
+        self._display_geometry = None
+        # (transform_matrix, その逆行列) — 逆行列はマウス移動ごとではなく行列が替わったときだけ求める。
+        # 特異な行列なら逆行列は None
+        self._inverse_cache = (None, None)
 
         # スライダー更新の再帰防止フラグ
         self._suppress_slider = False
 
-        # UIの構築
+        # スライダー変数（遅延構築されるパネルからも参照されるため先に作成）
+        self.scale_x = tk.DoubleVar(value=1.0)
+        self.scale_y = tk.DoubleVar(value=1.0)
+        self.rotation = tk.DoubleVar(value=0.0)
+        self.shear_x = tk.DoubleVar(value=0.0)
+        self.shear_y = tk.DoubleVar(value=0.0)
+        self.show_grid = tk.BooleanVar(value=True)
+        self.filter_spec = tk.StringVar(value=filters.spec() if filters else '')
+
+        # 遅延構築されるウィジェット（構築前はNone）
+        self.scale_entries = None
+        self.rotation_entries = None
+        self.shear_entries = None
+        self.order_frame = None
+        self.matrix_text = None
+
+        # 起動時間計測
+        self.startup_time_ms = None
+
+        # 操作トレースの記録（ハンドラをバインドより前に差し替える）
+        if recorder is not None:
+            recorder.install(self)
+
+        # UIの構築（画面外のパネルはアイドル時に構築）
         self.setup_ui()
 
         # 初期行列テキストを表示
         self.update_all_matrix_labels()
 
+        if self.speculator is not None:
+            self.speculator.install(self)
+
+        self.root.after_idle(self._report_startup_time)
+        self.root.after_idle(self._build_next_deferred_panel)
+        threading.Thread(target=_preload_heavy_modules, daemon=True).start()
+
     # ================================================================
     # UI構築
     # ================================================================
@@ -95,6 +181,7 @@ class ImageTransformGUI:
         self.setup_display_panel(right_panel)
 
     def setup_control_panel(self, parent):
+        """画面内のパネルのみ即時構築し、残りは遅延構築キューに積む"""
         header = tk.Label(parent, text="変換コントロール",
                          font=('Arial', 16, 'bold'), bg='#363636', fg='#ffffff')
         header.pack(pady=10, fill=tk.X)
@@ -113,18 +200,57 @@ class ImageTransformGUI:
                  command=self.save_image, bg='#2196F3', fg='black',
                  font=('Arial', 10), relief=tk.FLAT, padx=20, pady=5
                  ).pack(fill=tk.X, pady=2)
+        tk.Button(file_frame, text="複数サイズで書き出し",
+                 command=self.save_multi_size, bg='#2196F3', fg='black',
+                 font=('Arial', 10), relief=tk.FLAT, padx=20, pady=5
+                 ).pack(fill=tk.X, pady=2)
+        tk.Button(file_frame, text="パイプラインを保存",
+                 command=self.save_pipeline, bg='#607D8B', fg='black',
+                 font=('Arial', 10), relief=tk.FLAT, padx=20, pady=5
+                 ).pack(fill=tk.X, pady=2)
+
+        # 出力サイズと推定メモリ（書き出し前に確認できるように）
+        self.memory_label = tk.Label(file_frame, text="", bg='#363636', fg='#aaaaaa',
+                                    font=('Arial', 9), justify=tk.LEFT, anchor=tk.W)
+        self.memory_label.pack(fill=tk.X, pady=(4, 0))
 
-        # 各変換パラメータ
+        # 各変換パラメータ（画面内）
         self.setup_scale_controls(parent)
         self.setup_rotation_controls(parent)
-        self.setup_shear_controls(parent)
 
-        # 適用順序コントロール
-        self.setup_order_controls(parent)
+        # 画面外のパネル: 上から順にアイドル時に構築
+        self._deferred_panels = [
+            self.setup_shear_controls,
+            self.setup_order_controls,        # 適用順序コントロール
+            self.setup_combined_matrix_display,  # 合成結果行列
+            self.setup_filter_controls,       # 後処理フィルタ
+            self.setup_reset_controls,        # リセット・グリッド表示
+        ]
+        self._deferred_parent = parent
+
+    def _build_next_deferred_panel(self):
+        """遅延構築キューから1パネルだけ構築し、残りがあれば次のアイドルに回す"""
+        if not self._deferred_panels:
+            return
+        self._deferred_panels.pop(0)(self._deferred_parent)
+        if self._deferred_panels:
+            self.root.after_idle(self._build_next_deferred_panel)
+        else:
+            total_ms = (time.perf_counter() - _STARTUP_T0) * 1000.0
+            print(f"全パネル構築完了: {total_ms:.1f} ms")
 
-        # 合成結果行列
-        self.setup_combined_matrix_display(parent)
+    def ensure_panels_built(self):
+        """未構築のパネルを同期的にすべて構築"""
+        while self._deferred_panels:
+            self._deferred_panels.pop(0)(self._deferred_parent)
 
+    def _report_startup_time(self):
+        """起動から最初の操作可能フレームまでの時間を記録して表示"""
+        self.root.update_idletasks()
+        self.startup_time_ms = (time.perf_counter() - _STARTUP_T0) * 1000.0
+        print(f"起動時間（最初の操作可能フレームまで）: {self.startup_time_ms:.1f} ms")
+
+    def setup_reset_controls(self, parent):
         # リセット
         tk.Button(parent, text="すべてリセット",
                  command=self.reset_all, bg='#f44336', fg='black',
@@ -132,7 +258,6 @@ class ImageTransformGUI:
                  padx=20, pady=10).pack(fill=tk.X, padx=10, pady=10)
 
         # グリッド表示オプション
-        self.show_grid = tk.BooleanVar(value=True)
         tk.Checkbutton(parent, text="グリッド表示",
                       variable=self.show_grid, command=self.update_display,
                       bg='#363636', fg='#ffffff', selectcolor='#2b2b2b',
@@ -184,8 +309,7 @@ class ImageTransformGUI:
 
         tk.Label(frame, text="X:", bg='#363636', fg='#fff',
                 font=('Arial', 9)).pack(anchor=tk.W)
-        self.scale_x = tk.DoubleVar(value=1.0)
-        tk.Scale(frame, from_=0.1, to=3.0, resolution=0.05,
+        tk.Scale(frame, **self.SLIDER_RANGES['scale_x'],
                 orient=tk.HORIZONTAL, variable=self.scale_x,
                 command=self.on_transform_change, bg='#4a4a4a',
                 fg='#ffffff', highlightbackground='#363636',
@@ -193,13 +317,16 @@ class ImageTransformGUI:
 
         tk.Label(frame, text="Y:", bg='#363636', fg='#fff',
                 font=('Arial', 9)).pack(anchor=tk.W)
-        self.scale_y = tk.DoubleVar(value=1.0)
-        tk.Scale(frame, from_=0.1, to=3.0, resolution=0.05,
+        tk.Scale(frame, **self.SLIDER_RANGES['scale_y'],
                 orient=tk.HORIZONTAL, variable=self.scale_y,
                 command=self.on_transform_change, bg='#4a4a4a',
                 fg='#ffffff', highlightbackground='#363636',
                 troughcolor='#2b2b2b', length=250).pack(fill=tk.X)
 
+        tk.Button(frame, text="1:1にリセット", command=self.reset_scale,
+                 bg='#555555', fg='black', relief=tk.FLAT,
+                 font=('Arial', 8)).pack(anchor=tk.W, pady=4)
+
         self.scale_entries = self.create_matrix_entries(frame, 'scale', '#4FC3F7')
 
     # ---------- 回転 ----------
@@ -211,8 +338,7 @@ class ImageTransformGUI:
 
         tk.Label(frame, text="角度(度):", bg='#363636', fg='#fff',
                 font=('Arial', 9)).pack(anchor=tk.W)
-        self.rotation = tk.DoubleVar(value=0.0)
-        tk.Scale(frame, from_=-180, to=180, resolution=1,
+        tk.Scale(frame, **self.SLIDER_RANGES['rotation'],
                 orient=tk.HORIZONTAL, variable=self.rotation,
                 command=self.on_transform_change, bg='#4a4a4a',
                 fg='#ffffff', highlightbackground='#363636',
@@ -220,7 +346,7 @@ class ImageTransformGUI:
 
         preset_frame = tk.Frame(frame, bg='#363636')
         preset_frame.pack(fill=tk.X, pady=4)
-        for angle in [90, 120, 180, 270]:
+        for angle in self.ROTATION_PRESETS:
             tk.Button(preset_frame, text=f"{angle}°",
                      command=lambda a=angle: self.set_rotation(a),
                      bg='#555555', fg='black', relief=tk.FLAT,
@@ -237,8 +363,7 @@ class ImageTransformGUI:
 
         tk.Label(frame, text="X方向:", bg='#363636', fg='#fff',
                 font=('Arial', 9)).pack(anchor=tk.W)
-        self.shear_x = tk.DoubleVar(value=0.0)
-        tk.Scale(frame, from_=-2.0, to=2.0, resolution=0.05,
+        tk.Scale(frame, **self.SLIDER_RANGES['shear_x'],
                 orient=tk.HORIZONTAL, variable=self.shear_x,
                 command=self.on_transform_change, bg='#4a4a4a',
                 fg='#ffffff', highlightbackground='#363636',
@@ -246,14 +371,46 @@ class ImageTransformGUI:
 
         tk.Label(frame, text="Y方向:", bg='#363636', fg='#fff',
                 font=('Arial', 9)).pack(anchor=tk.W)
-        self.shear_y = tk.DoubleVar(value=0.0)
-        tk.Scale(frame, from_=-2.0, to=2.0, resolution=0.05,
+        tk.Scale(frame, **self.SLIDER_RANGES['shear_y'],
                 orient=tk.HORIZONTAL, variable=self.shear_y,
                 command=self.on_transform_change, bg='#4a4a4a',
                 fg='#ffffff', highlightbackground='#363636',
                 troughcolor='#2b2b2b', length=250).pack(fill=tk.X)
 
         self.shear_entries = self.create_matrix_entries(frame, 'shear', '#FFB74D')
+        self.update_matrix_entries('shear')
+
+    # ---------- 後処理フィルタ ----------
+    def setup_filter_controls(self, parent):
+        frame = tk.LabelFrame(parent, text="後処理フィルタ（左から順に適用）",
+                             font=('Arial', 10, 'bold'), bg='#363636',
+                             fg='#ffffff', padx=10, pady=8)
+        frame.pack(fill=tk.X, padx=10, pady=4)
+
+        tk.Entry(frame, textvariable=self.filter_spec, bg='#2b2b2b', fg='#ffffff',
+                insertbackground='#ffffff', font=('Consolas', 9)).pack(fill=tk.X)
+        tk.Label(frame, text="例: sharpen:amount=0.8,gamma:2.2,grayscale",
+                bg='#363636', fg='#aaa', font=('Arial', 8)).pack(anchor=tk.W)
+        tk.Button(frame, text="適用", command=self.apply_filters,
+                 bg='#607D8B', fg='black', font=('Arial', 9), relief=tk.FLAT
+                 ).pack(fill=tk.X, pady=(4, 0))
+
+    def apply_filters(self):
+        """入力欄のフィルタ指定を解釈して適用"""
+        try:
+            chain = post_filters.parse_chain(self.filter_spec.get())
+        except (ValueError, TypeError) as e:
+            messagebox.showerror("エラー", f"フィルタの指定が正しくありません:\n{e}")
+            return
+        self.set_filters(chain)
+
+    def set_filters(self, chain):
+        """フィルタチェーンを差し替えてプレビューを描き直す（Noneでフィルタなし）"""
+        self.filters = chain
+        self.filter_spec.set(chain.spec() if chain else '')
+        if self.speculator is not None:
+            self.speculator.clear()
+        self.rerender_preview()
 
     # ---------- 適用順序 ----------
     def setup_order_controls(self, parent):
@@ -269,6 +426,8 @@ class ImageTransformGUI:
 
     def rebuild_order_ui(self):
         """適用順序UIを再構築"""
+        if self.order_frame is None:
+            return
         for w in self.order_frame.winfo_children():
             w.destroy()
 
@@ -356,7 +515,7 @@ class ImageTransformGUI:
         canvas_frame = tk.Frame(parent, bg='#2b2b2b', relief=tk.SUNKEN,
                                borderwidth=2)
         canvas_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=(10, 0))
-        self.canvas = tk.Canvas(canvas_frame, bg='#1e1e1e', highlightthickness=0)
+        self.canvas = tk.Canvas(canvas_frame, bg=self.CANVAS_BG, highlightthickness=0)
         self.canvas.pack(fill=tk.BOTH, expand=True)
 
         self.setup_zoom_bar(parent)
@@ -364,6 +523,7 @@ class ImageTransformGUI:
         # マウスイベント
         self.canvas.bind("<ButtonPress-1>", self.on_mouse_press)
         self.canvas.bind("<B1-Motion>", self.on_mouse_drag)
+        self.canvas.bind("<Motion>", self.on_mouse_move)
         self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
         self.canvas.bind("<Button-4>", self.on_mouse_wheel)
         self.canvas.bind("<Button-5>", self.on_mouse_wheel)
@@ -390,6 +550,11 @@ class ImageTransformGUI:
                  bg='#555555', fg='black', relief=tk.FLAT,
                  font=('Arial', 9), width=4, padx=2).pack(side=tk.LEFT, padx=(0, 8))
 
+        # カーソル位置の元画像座標
+        self.coord_label = tk.Label(zoom_bar, text="", bg='#2b2b2b', fg='#aaaaaa',
+                                   font=('Courier', 9), anchor=tk.W)
+        self.coord_label.pack(side=tk.LEFT)
+
         zoom_right = tk.Frame(zoom_bar, bg='#2b2b2b')
         zoom_right.pack(side=tk.RIGHT)
 
@@ -417,48 +582,152 @@ class ImageTransformGUI:
     def load_image(self):
         file_path = filedialog.askopenfilename(
             title="画像を選択",
-            filetypes=[("画像ファイル", "*.png *.jpg *.jpeg *.bmp *.gif"),
+            filetypes=[("画像ファイル", "*.png *.jpg *.jpeg *.bmp *.gif *.tif *.tiff"),
                        ("すべてのファイル", "*.*")],
             initialfile="image.png")
         if not file_path:
             return
         try:
-            self.image_path = file_path
-            self.original_image = cv2.imread(file_path, cv2.IMREAD_UNCHANGED)
-            if self.original_image is None:
-                raise ValueError("画像を読み込めませんでした")
-            if len(self.original_image.shape) == 3:
-                if self.original_image.shape[2] == 4:
-                    self.original_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGRA2RGBA)
-                else:
-                    self.original_image = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGB)
-            self.current_image = self.original_image.copy()
-            self.reset_all()
+            self.open_image(file_path)
         except Exception as e:
             messagebox.showerror("エラー", f"画像の読み込みに失敗:\n{e}")
 
+    def open_image(self, file_path):
+        """指定パスの画像を読み込んで表示（ダイアログなし）"""
+        self.image_path = file_path
+        if self.image_cache is not None:
+            self.original_image = self.image_cache.load(file_path)
+        else:
+            self.original_image = transform_core.read_image(file_path)
+        self.preview_source = transform_core.preview_proxy(self.original_image)
+        if self.speculator is not None:
+            self.speculator.clear()
+        self.current_image = self.preview_source.copy()
+        self.reset_all()
+
     def save_image(self):
         if self.current_image is None:
             messagebox.showwarning("警告", "保存する画像がありません")
             return
         file_path = filedialog.asksaveasfilename(
             title="画像を保存", defaultextension=".png",
-            filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg"), ("すべて", "*.*")])
+            filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg"), ("TIFF", "*.tif *.tiff"),
+                       ("すべて", "*.*")])
         if not file_path:
             return
+        alpha = transform_core.format_has_alpha(file_path)
+        tiled = self.confirm_export_tiling(alpha)
+        if tiled is None:
+            return
+
+        import cv2
         try:
-            if len(self.current_image.shape) == 3:
-                if self.current_image.shape[2] == 4:
-                    out = cv2.cvtColor(self.current_image, cv2.COLOR_RGBA2BGRA)
-                else:
-                    out = cv2.cvtColor(self.current_image, cv2.COLOR_RGB2BGR)
-            else:
-                out = self.current_image
-            cv2.imwrite(file_path, out)
+            out = self.render_export(tiled, os.path.dirname(os.path.abspath(file_path)), alpha)
+            if not cv2.imwrite(file_path, transform_core.fit_format_depth(out, file_path)):
+                raise ValueError(f"書き出しに失敗しました: {file_path}")
             messagebox.showinfo("成功", "画像を保存しました！")
         except Exception as e:
             messagebox.showerror("エラー", f"保存失敗:\n{e}")
 
+    def save_multi_size(self):
+        """フル解像度を一度だけ描画し、書き出しプロファイルの全サイズを保存"""
+        if self.current_image is None:
+            messagebox.showwarning("警告", "保存する画像がありません")
+            return
+        file_path = filedialog.asksaveasfilename(
+            title="複数サイズで書き出し（ベース名）", defaultextension="")
+        if not file_path:
+            return
+        alpha = any(transform_core.format_has_alpha(p['format']) for p in self.export_profiles)
+        tiled = self.confirm_export_tiling(alpha, multi_size=True)
+        if tiled is None:
+            return
+
+        base = os.path.splitext(file_path)[0]
+        try:
+            out = self.render_export(tiled, os.path.dirname(os.path.abspath(file_path)), alpha)
+            paths = multi_export.export_profiles(out, base, self.export_profiles)
+            messagebox.showinfo("成功", "画像を保存しました！\n" +
+                                "\n".join(os.path.basename(p) for p in paths))
+        except Exception as e:
+            messagebox.showerror("エラー", f"保存失敗:\n{e}")
+
+    def save_pipeline(self):
+        """現在の各変換の行列と適用順序をJSONで保存（watch_folder.py で使用）
+
+        行列を直接適用している間は、その行列を 'custom' という1つの変換として保存する
+        （出力に収める平行移動は読み込み側で付け直すので、プレビューと同じ結果になる）
+        """
+        file_path = filedialog.asksaveasfilename(
+            title="パイプラインを保存", defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("すべて", "*.*")])
+        if not file_path:
+            return
+        if self.custom_matrix is not None:
+            matrices, order = {'custom': self.custom_matrix}, ['custom']
+        else:
+            matrices, order = self.matrices, self.transform_order
+        try:
+            transform_core.save_pipeline(file_path, matrices, order,
+                                         self.filters.spec() if self.filters else None)
+            messagebox.showinfo("成功", "パイプラインを保存しました！")
+        except Exception as e:
+            messagebox.showerror("エラー", f"保存失敗:\n{e}")
+
+    def confirm_export_tiling(self, alpha=True, multi_size=False):
+        """書き出しがメモリ予算を超えるか判定し、超える場合は確認する
+
+        タイル単位で書き出すなら True、通常の書き出しなら False、取り消されたら None を返す。
+        multi_size=True なら、縮小元のフル解像度画像を一時ファイルに置くことも伝える
+        """
+        out_w, out_h = self.output_size
+        itemsize = self.original_image.itemsize
+        channels = transform_core.output_channels(self.original_image, alpha)
+        tiled = self.governor.needs_tiling(out_w, out_h, channels, itemsize)
+        if tiled:
+            nbytes = memory_governor.estimate_output_bytes(out_w, out_h, channels, itemsize)
+            message = (f"出力 {out_w}×{out_h}（約 {memory_governor.format_bytes(nbytes)}）は"
+                       f"メモリ予算 {memory_governor.format_bytes(self.governor.export_budget)} を"
+                       f"超えるため、タイル単位で書き出します。")
+            if multi_size:
+                # 縮小とフル解像度のエンコードには全体が要るため、メモリに置けない分はディスクに置く
+                message += ("\n\n複数サイズの書き出しでは、フル解像度の描画結果を保存先のフォルダーの"
+                            "一時ファイル（書き出し後に自動で削除）に置いてから縮小します。\n\n")
+            if not messagebox.askokcancel("確認", message + "続けますか？"):
+                return None
+        return tiled
+
+    def render_export(self, tiled, work_dir=None, alpha=True):
+        """書き出し用のフル解像度画像をBGR(A)順で返す
+
+        アルファ付きの8bit画像でプレビューがフル解像度ならそれを使い、それ以外は描画し直す
+        （不透明な画像のプレビューは背景色の上に、8bit以外はプレビュー用の8bit画像から描いてあるため）。
+        書き出しは元画像の型（16bit・浮動小数）のまま描画する。
+        alpha=False なら不透明な画像はアルファなしで描画する。
+        予算超過時は work_dir 上のメモリマップにタイル単位で描画する。
+        フィルタはワープと同じ帯の中で適用する（フィルタ前のフル解像度画像は作らない）
+        """
+        src = self.original_image
+        out_w, out_h = self.output_size
+        if (self.preview_scale >= 1.0 and self.preview_source is src
+                and not transform_core.is_opaque(src)):
+            image = self.current_image
+        elif tiled:
+            buf = memory_governor.tiled_output_buffer(
+                out_w, out_h, transform_core.output_channels(src, alpha), src.dtype,
+                directory=work_dir)
+            if self.filters:
+                return post_filters.render_output(
+                    src, self.transform_matrix, out_w, out_h, self.filters, alpha,
+                    out=buf, convert=transform_core.to_bgr)
+            return memory_governor.render_tiled(
+                src, self.transform_matrix, out_w, out_h, buf,
+                convert=transform_core.to_bgr, alpha=alpha)
+        else:
+            image = post_filters.render_output(
+                src, self.transform_matrix, out_w, out_h, self.filters, alpha)
+        return transform_core.to_bgr(image)
+
     # ================================================================
     # 変換ロジック
     # ================================================================
@@ -471,106 +740,106 @@ class ImageTransformGUI:
 
     def build_individual_matrices(self):
         """各変換の行列を構築して保存"""
-        sx, sy = self.scale_x.get(), self.scale_y.get()
-        self.matrices['scale'] = np.array([
-            [sx, 0, 0],
-            [0, sy, 0],
-            [0, 0, 1]
-        ])
-
-        a = math.radians(self.rotation.get())
-        c, s = math.cos(a), math.sin(a)
-        self.matrices['rotation'] = np.array([
-            [c, -s, 0],
-            [s,  c, 0],
-            [0,  0, 1]
-        ])
-
-        hx, hy = self.shear_x.get(), self.shear_y.get()
-        self.matrices['shear'] = np.array([
-            [1,  hx, 0],
-            [hy,  1, 0],
-            [0,   0, 1]
-        ])
+        self.matrices.update(transform_core.build_individual_matrices(
+            self.scale_x.get(), self.scale_y.get(), self.rotation.get(),
+            self.shear_x.get(), self.shear_y.get()))
 
     def compute_output_bounds(self, w, h, combined_linear):
         """変換後の四隅から必要な出力サイズとオフセットを計算"""
-        corners = np.array([
-            [0, 0, 1],
-            [w, 0, 1],
-            [w, h, 1],
-            [0, h, 1]
-        ], dtype=float).T  # 3x4
-
-        transformed = combined_linear @ corners  # 3x4
-        xs = transformed[0]
-        ys = transformed[1]
-
-        min_x, max_x = xs.min(), xs.max()
-        min_y, max_y = ys.min(), ys.max()
-
-        # パディングを追加
-        pad = max(w, h) * 0.25
-        min_x -= pad
-        min_y -= pad
-        max_x += pad
-        max_y += pad
-
-        out_w = int(math.ceil(max_x - min_x))
-        out_h = int(math.ceil(max_y - min_y))
-
-        return out_w, out_h, min_x, min_y
+        return transform_core.compute_output_bounds(w, h, combined_linear)
 
     def apply_transform(self):
         if self.original_image is None:
             return
 
         h, w = self.original_image.shape[:2]
-        cx, cy = w / 2.0, h / 2.0
 
         self.build_individual_matrices()
 
-        # 適用順序に従って行列を合成（画像中心を原点として変換）
-        to_origin = np.array([[1, 0, -cx], [0, 1, -cy], [0, 0, 1]])
-        from_origin = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]])
-
-        # 中心基準の合成変換を構築
-        combined = np.eye(3)
-        for key in self.transform_order:
-            combined = self.matrices[key] @ combined
-
-        # 完全な変換: 中心に移動 → 変換 → 戻す
-        full = from_origin @ combined @ to_origin
-
-        # 出力サイズを動的計算
-        out_w, out_h, min_x, min_y = self.compute_output_bounds(w, h, full)
-
+        # 適用順序に従って行列を合成（画像中心を原点として変換）し、
         # 出力画像内に収まるよう平行移動を追加
-        offset = np.array([[1, 0, -min_x], [0, 1, -min_y], [0, 0, 1]])
-        self.transform_matrix = offset @ full
-
-        transform_2x3 = self.transform_matrix[:2, :]
+        self.transform_matrix, out_w, out_h = transform_core.build_transform(
+            w, h, self.matrices, self.transform_order)
+        self.custom_matrix = None
 
         try:
             # RGBA変換して透明背景でワープ
-            src = self.original_image
-            if len(src.shape) == 2:
-                src = cv2.cvtColor(src, cv2.COLOR_GRAY2RGBA)
-            elif src.shape[2] == 3:
-                src = cv2.cvtColor(src, cv2.COLOR_RGB2RGBA)
-
-            self.current_image = cv2.warpAffine(
-                src, transform_2x3,
-                (out_w, out_h),
-                flags=cv2.INTER_LINEAR,
-                borderMode=cv2.BORDER_CONSTANT,
-                borderValue=(0, 0, 0, 0))
+            self.render_preview(out_w, out_h)
 
             self.update_all_matrix_labels()
             self.update_matrix_display()
             self.update_display()
         except Exception as e:
-            print(f"変換エラー: {e}")
+            self.report_transform_error(e)
+            return
+
+        if self.speculator is not None:
+            self.speculator.schedule()
+
+    def render_preview(self, out_w, out_h):
+        """self.transform_matrix でプレビューをワープ（出力が予算を超える場合は縮小して描画）"""
+        self.output_size = (out_w, out_h)
+        background = self.CANVAS_BG_RGB
+        self.preview_scale = self.governor.preview_scale(
+            out_w, out_h, transform_core.preview_channels(self.preview_source, background),
+            self.preview_source.itemsize)
+        self.update_memory_label()
+        matrix, pw, ph = memory_governor.scaled_transform(
+            self.transform_matrix, out_w, out_h, self.preview_scale)
+        if self.speculator is not None:
+            cached = self.speculator.lookup(matrix, pw, ph)
+            if cached is not None:
+                self.current_image = cached
+                return
+        self.current_image = post_filters.render_preview(
+            self.preview_source, matrix, pw, ph, self.filters, background)
+        if self.speculator is not None:
+            self.speculator.store(matrix, pw, ph, self.current_image)
+
+    def rerender_preview(self):
+        """現在の transform_matrix と出力サイズのままプレビューを描き直す
+
+        スライダーから行列を作り直さないので、直接入力した行列もそのまま保たれる
+        """
+        if self.original_image is None:
+            return
+        try:
+            self.render_preview(*self.output_size)
+            self.update_display()
+        except Exception as e:
+            self.report_transform_error(e)
+
+    def update_memory_label(self):
+        """出力サイズと推定メモリ、ガバナーの判断を表示
+
+        書き出し（confirm_export_tiling）と同じチャンネル数で見積もる。
+        不透明な画像はアルファ付きの形式とそれ以外で値が変わるので両方を表示する
+        """
+        out_w, out_h = self.output_size
+        src = self.original_image
+        itemsize = src.itemsize
+        with_alpha = transform_core.output_channels(src, alpha=True)
+        without_alpha = transform_core.output_channels(src, alpha=False)
+        nbytes = memory_governor.estimate_output_bytes(out_w, out_h, with_alpha, itemsize)
+        text = f"出力 {out_w}×{out_h}  約 {memory_governor.format_bytes(nbytes)}"
+        if without_alpha != with_alpha:
+            nbytes = memory_governor.estimate_output_bytes(out_w, out_h, without_alpha, itemsize)
+            text += f"（アルファなし {memory_governor.format_bytes(nbytes)}）"
+        color = '#aaaaaa'
+        if self.preview_scale < 1.0:
+            text += f"\nプレビュー縮小 {self.preview_scale * 100:.0f}%"
+            color = '#FFB74D'
+        if self.governor.needs_tiling(out_w, out_h, without_alpha, itemsize):
+            text += "\n予算超過: 書き出しはタイル単位"
+            color = '#f44336'
+        elif self.governor.needs_tiling(out_w, out_h, with_alpha, itemsize):
+            text += "\n予算超過: アルファ付きの形式（PNG等）はタイル単位"
+            color = '#f44336'
+        self.memory_label.config(text=text, fg=color)
+
+    def report_transform_error(self, e):
+        print(f"変換エラー: {e}")
+        self.memory_label.config(text=f"変換エラー: {e}", fg='#f44336')
 
     # ================================================================
     # 行列表示更新
@@ -582,14 +851,7 @@ class ImageTransformGUI:
 
     def parse_expr(self, text):
         """√対応の数式パーサー。例: √2, 1/√2, -√3/2, √2/2"""
-        text = text.strip()
-        if not text:
-            return 0.0
-        # √N → sqrt(N) に置換
-        text = re.sub(r'√(\d+\.?\d*)', r'sqrt(\1)', text)
-        # 安全な評価
-        allowed = {"__builtins__": {}, "sqrt": math.sqrt, "pi": math.pi}
-        return float(eval(text, allowed))
+        return transform_core.parse_expr(text)
 
     # ================================================================
     # Entry操作
@@ -613,11 +875,17 @@ class ImageTransformGUI:
     def update_all_matrix_labels(self):
         """スライダー値から各エントリを更新"""
         for key in ['scale', 'rotation', 'shear']:
-            entries = self.get_entries(key)
-            m = self.matrices[key]
-            for r in range(2):
-                for c in range(2):
-                    self.set_entry_value(entries[r][c], m[r, c])
+            self.update_matrix_entries(key)
+
+    def update_matrix_entries(self, key):
+        """指定した変換のエントリを現在の行列で更新（未構築なら何もしない）"""
+        entries = self.get_entries(key)
+        if entries is None:
+            return
+        m = self.matrices[key]
+        for r in range(2):
+            for c in range(2):
+                self.set_entry_value(entries[r][c], m[r, c])
 
     def apply_matrix_input(self, key):
         """各変換のEntryから行列を読み取って適用"""
@@ -665,43 +933,22 @@ class ImageTransformGUI:
             return
 
         h, w = self.original_image.shape[:2]
-        cx, cy = w / 2.0, h / 2.0
-
-        to_origin = np.array([[1, 0, -cx], [0, 1, -cy], [0, 0, 1]])
-        from_origin = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]])
-
-        combined = np.eye(3)
-        for key in self.transform_order:
-            combined = self.matrices[key] @ combined
-
-        full = from_origin @ combined @ to_origin
 
-        out_w, out_h, min_x, min_y = self.compute_output_bounds(w, h, full)
-        offset = np.array([[1, 0, -min_x], [0, 1, -min_y], [0, 0, 1]])
-        self.transform_matrix = offset @ full
-
-        transform_2x3 = self.transform_matrix[:2, :]
+        self.transform_matrix, out_w, out_h = transform_core.build_transform(
+            w, h, self.matrices, self.transform_order)
+        self.custom_matrix = None
 
         try:
-            src = self.original_image
-            if len(src.shape) == 2:
-                src = cv2.cvtColor(src, cv2.COLOR_GRAY2RGBA)
-            elif src.shape[2] == 3:
-                src = cv2.cvtColor(src, cv2.COLOR_RGB2RGBA)
-
-            self.current_image = cv2.warpAffine(
-                src, transform_2x3,
-                (out_w, out_h),
-                flags=cv2.INTER_LINEAR,
-                borderMode=cv2.BORDER_CONSTANT,
-                borderValue=(0, 0, 0, 0))
+            self.render_preview(out_w, out_h)
 
             self.update_matrix_display()
             self.update_display()
         except Exception as e:
-            print(f"変換エラー: {e}")
+            self.report_transform_error(e)
 
     def update_matrix_display(self):
+        if self.matrix_text is None:
+            return
         self.matrix_text.delete('1.0', tk.END)
         s = "[\n"
         for row in self.transform_matrix[:2]:
@@ -724,20 +971,10 @@ class ImageTransformGUI:
             custom = np.array(vals + [[0, 0, 1]])
             if self.original_image is not None:
                 h, w = self.original_image.shape[:2]
-                out_w, out_h, min_x, min_y = self.compute_output_bounds(w, h, custom)
-                offset = np.array([[1, 0, -min_x], [0, 1, -min_y], [0, 0, 1]])
-                final = offset @ custom
-                t2x3 = final[:2, :]
-                src = self.original_image
-                if len(src.shape) == 2:
-                    src = cv2.cvtColor(src, cv2.COLOR_GRAY2RGBA)
-                elif src.shape[2] == 3:
-                    src = cv2.cvtColor(src, cv2.COLOR_RGB2RGBA)
-                self.current_image = cv2.warpAffine(
-                    src, t2x3, (out_w, out_h),
-                    flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_CONSTANT,
-                    borderValue=(0, 0, 0, 0))
+                final, out_w, out_h = transform_core.fit_to_output(w, h, custom)
                 self.transform_matrix = final
+                self.custom_matrix = custom
+                self.render_preview(out_w, out_h)
                 self.update_display()
         except Exception as e:
             messagebox.showerror("エラー", f"行列適用失敗:\n{e}")
@@ -749,6 +986,7 @@ class ImageTransformGUI:
     def update_display(self):
         if self.current_image is None:
             return
+        from PIL import Image, ImageTk
 
         self.canvas.delete('all')
         self.canvas.update()
@@ -757,11 +995,14 @@ class ImageTransformGUI:
         if cw <= 1 or ch <= 1:
             cw, ch = 800, 600
 
-        if self.show_grid.get():
+        # 不透明な画像のプレビューは余白を背景色で塗ってあるので、グリッドは画像の後に
+        # 元画像の四角形の外側だけ描く（透明な余白を持つ画像は下に描いて透かす）
+        opaque = transform_core.is_opaque(self.original_image)
+        if self.show_grid.get() and not opaque:
             self.draw_grid(cw, ch)
 
         if len(self.current_image.shape) == 3:
-            mode = 'RGBA' if self.current_image.shape[2] == 4 else 'RGB'
+            mode = 'RGB' if self.current_image.shape[2] == 3 else 'RGBA'
         else:
             mode = 'L'
         pil_image = Image.fromarray(self.current_image, mode)
@@ -775,8 +1016,9 @@ class ImageTransformGUI:
         base_scale = min(cw / ow, ch / oh, 1.0) * 0.85
         final_scale = base_scale * self.view_zoom
 
-        nw = max(int(iw * final_scale), 1)
-        nh = max(int(ih * final_scale), 1)
+        # 縮小プレビューはフル解像度相当の大きさで表示
+        nw = max(int(iw * final_scale / self.preview_scale), 1)
+        nh = max(int(ih * final_scale / self.preview_scale), 1)
         pil_image = pil_image.resize((nw, nh), Image.Resampling.LANCZOS)
 
         self.display_image = ImageTk.PhotoImage(pil_image)
@@ -784,17 +1026,77 @@ class ImageTransformGUI:
         x = (cw - nw) // 2 + self.view_offset_x
         y = (ch - nh) // 2 + self.view_offset_y
         self.canvas.create_image(x, y, anchor=tk.NW, image=self.display_image)
+        self._display_geometry = (x, y, nw / iw, nh / ih)
+        if self.show_grid.get() and opaque:
+            self.draw_grid(cw, ch, exclude=self.display_quad())
 
         pct = int(round(self.view_zoom * 100))
         self.zoom_label.config(text=f"{pct}%")
 
-    def draw_grid(self, w, h):
+    def draw_grid(self, w, h, exclude=None):
+        """グリッドと中心軸を描く（exclude の四角形の内側は描かない）"""
+        def line(x0, y0, x1, y1, **kw):
+            for (a, b), (c, d) in self._outside_segments((x0, y0), (x1, y1), exclude):
+                self.canvas.create_line(a, b, c, d, **kw)
+
         for x in range(0, w, 50):
-            self.canvas.create_line(x, 0, x, h, fill='#333333')
+            line(x, 0, x, h, fill='#333333')
         for y in range(0, h, 50):
-            self.canvas.create_line(0, y, w, y, fill='#333333')
-        self.canvas.create_line(w//2, 0, w//2, h, fill='#4CAF50', width=2, dash=(5,5))
-        self.canvas.create_line(0, h//2, w, h//2, fill='#4CAF50', width=2, dash=(5,5))
+            line(0, y, w, y, fill='#333333')
+        line(w//2, 0, w//2, h, fill='#4CAF50', width=2, dash=(5,5))
+        line(0, h//2, w, h//2, fill='#4CAF50', width=2, dash=(5,5))
+
+    def display_quad(self):
+        """表示中の元画像の外周（画素の外縁）のキャンバス上の四隅（表示していなければNone）"""
+        if self._display_geometry is None or self.original_image is None:
+            return None
+        h, w = self.original_image.shape[:2]
+        corners = [[-0.5, -0.5], [w - 0.5, -0.5], [w - 0.5, h - 0.5], [-0.5, h - 0.5]]
+        out = geometry_transform.transform_points(corners, self.transform_matrix)
+        # canvas_to_source の逆: フル解像度の出力座標 → プレビューの座標 → キャンバス座標
+        x0, y0, fx, fy = self._display_geometry
+        s = self.preview_scale
+        return np.column_stack([x0 - 0.5 + (out[:, 0] * s + 0.5) * fx,
+                                y0 - 0.5 + (out[:, 1] * s + 0.5) * fy])
+
+    @staticmethod
+    def _outside_segments(p0, p1, quad):
+        """線分 p0-p1 のうち凸四角形 quad の外側の部分を (始点, 終点) のリストで返す"""
+        p0 = np.asarray(p0, dtype=float)
+        d = np.asarray(p1, dtype=float) - p0
+        if quad is None:
+            return [(p0, p0 + d)]
+
+        def cross(u, v):
+            return u[0] * v[1] - u[1] * v[0]
+
+        edges = [(quad[i], quad[(i + 1) % 4] - quad[i]) for i in range(4)]
+        area = sum(cross(a, e) for a, e in edges)
+        if abs(area) < 1e-9:
+            return [(p0, p0 + d)]  # 潰れた四角形（特異な行列）
+        sign = 1.0 if area > 0 else -1.0
+        # 各辺の内側 sign * cross(e, p - a) >= 0 を満たす t の範囲を絞る
+        t0, t1 = 0.0, 1.0
+        for a, e in edges:
+            num = sign * cross(e, p0 - a)
+            den = sign * cross(e, d)
+            if abs(den) < 1e-12:
+                if num < 0:
+                    return [(p0, p0 + d)]
+                continue
+            t = -num / den
+            if den > 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+        if t0 >= t1:
+            return [(p0, p0 + d)]
+        segments = []
+        if t0 > 0:
+            segments.append((p0, p0 + t0 * d))
+        if t1 < 1:
+            segments.append((p0 + t1 * d, p0 + d))
+        return segments
 
     # ================================================================
     # ビュー操作
@@ -825,6 +1127,39 @@ class ImageTransformGUI:
         if self.current_image is not None:
             self.update_display()
 
+    def canvas_to_source(self, px, py):
+        """キャンバス上の座標を元画像の画素座標に戻す（画像が表示されていなければNone）"""
+        if self._display_geometry is None:
+            return None
+        x0, y0, fx, fy = self._display_geometry
+        # 表示用リサイズは画素中心基準なので半画素ずらしてプレビューの座標に戻し、
+        # プレビューの縮小率で割ってフル解像度の出力座標にする
+        inverse = self.inverse_matrix()
+        if inverse is None:
+            return None
+        s = self.preview_scale
+        out = [[((px - x0 + 0.5) / fx - 0.5) / s, ((py - y0 + 0.5) / fy - 0.5) / s]]
+        sx, sy = geometry_transform.transform_points(out, inverse)[0]
+        return sx, sy
+
+    def inverse_matrix(self):
+        """transform_matrix の逆行列（行列が替わったときだけ計算し直す。特異ならNone）"""
+        matrix, inverse = self._inverse_cache
+        if matrix is not self.transform_matrix:
+            try:
+                inverse = geometry_transform.invert(self.transform_matrix)
+            except np.linalg.LinAlgError:
+                inverse = None
+            self._inverse_cache = (self.transform_matrix, inverse)
+        return inverse
+
+    def on_mouse_move(self, event):
+        pos = self.canvas_to_source(event.x, event.y)
+        if pos is None:
+            self.coord_label.config(text="")
+            return
+        self.coord_label.config(text=f"元画像: ({pos[0]:.1f}, {pos[1]:.1f})")
+
     def on_mouse_press(self, event):
         self.drag_start_x = event.x
         self.drag_start_y = event.y
@@ -882,8 +1217,14 @@ class ImageTransformGUI:
     # ================================================================
 
     def reset_scale(self):
-        self.scale_x.set(1.0)
-        self.scale_y.set(1.0)
+        """スケールを 1:1 に戻して変換し直す（X・Y の2回ではなく1回だけ描画）"""
+        self._suppress_slider = True
+        try:
+            self.scale_x.set(1.0)
+            self.scale_y.set(1.0)
+        finally:
+            self._suppress_slider = False
+        self.on_transform_change()
 
     def set_rotation(self, angle):
         self.rotation.set(angle)
@@ -897,11 +1238,20 @@ class ImageTransformGUI:
         self.transform_order = ['scale', 'rotation', 'shear']
         self.rebuild_order_ui()
         self.transform_matrix = np.eye(3)
+        self.custom_matrix = None
         for k in self.matrices:
             self.matrices[k] = np.eye(3)
 
         if self.original_image is not None:
-            self.current_image = self.original_image.copy()
+            h, w = self.original_image.shape[:2]
+            if self.filters:
+                self.current_image = post_filters.render_preview(
+                    self.preview_source, np.eye(3), w, h, self.filters, self.CANVAS_BG_RGB)
+            else:
+                self.current_image = self.preview_source.copy()
+            self.output_size = (w, h)
+            self.preview_scale = 1.0
+            self.update_memory_label()
             self.reset_view()
             self.update_all_matrix_labels()
             self.update_display()
@@ -909,9 +1259,50 @@ class ImageTransformGUI:
 
 
 def main():
+    parser = argparse.ArgumentParser(description="画像行列変換ツール")
+    image_cache.add_arguments(parser)
+    parser.add_argument('--preview-budget', type=int, metavar='MB',
+                        default=memory_governor.DEFAULT_PREVIEW_BUDGET >> 20,
+                        help="プレビュー出力のメモリ予算（超えると縮小して描画）")
+    parser.add_argument('--export-budget', type=int, metavar='MB',
+                        default=memory_governor.DEFAULT_EXPORT_BUDGET >> 20,
+                        help="書き出しのメモリ予算（超えるとタイル単位で描画）")
+    parser.add_argument('--export-profile', type=multi_export.parse_profile,
+                        action='append', metavar='SPEC',
+                        help="複数サイズ書き出しのプロファイル SIZE:FORMAT[:QUALITY]（複数指定可）")
+    parser.add_argument('--speculative', action='store_true',
+                        help="プリセットやスライダーの隣の状態をアイドル時に先読み描画する")
+    parser.add_argument('--speculative-cache', type=int, metavar='MB',
+                        default=speculative_render.DEFAULT_MAX_BYTES >> 20,
+                        help="先読み描画のキャッシュ上限（MB）")
+    parser.add_argument('--filters', metavar='SPEC',
+                        help="ワープ後の後処理フィルタ（例: sharpen:amount=0.8,gamma:2.2,grayscale）")
+    args = parser.parse_args()
+
+    try:
+        filters = post_filters.parse_chain(args.filters)
+    except (ValueError, TypeError) as e:
+        parser.error(f"--filters: {e}")
+    if args.export_profile:
+        try:
+            multi_export.check_profiles(args.export_profile)
+        except ValueError as e:
+            parser.error(f"--export-profile: {e}")
+
+    cache = image_cache.from_args(args)
+
     root = tk.Tk()
-    app = ImageTransformGUI(root)
+    governor = memory_governor.MemoryGovernor(args.preview_budget << 20,
+                                              args.export_budget << 20)
+    speculator = None
+    if args.speculative:
+        speculator = speculative_render.SpeculativeRenderer(args.speculative_cache << 20)
+    app = ImageTransformGUI(root, image_cache=cache, governor=governor,
+                            export_profiles=args.export_profile, speculator=speculator,
+                            filters=filters)
     root.mainloop()
+    if speculator is not None:
+        speculator.print_report()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+操作トレースの記録と再生（UIレイテンシの回帰テスト用）
+ドラッグ・ホイール・回転ジェスチャ・スライダー・適用順序の各ハンドラ呼び出しを
+タイムスタンプ付きでJSON Linesに記録し、再生時にイベントから描画完了までの時間を計測する
+
+仮想ディスプレイ上での実行例:
+    xvfb-run -s "-screen 0 1600x1000x24" python interaction_trace.py replay trace.jsonl
+"""
+
+import argparse
+import json
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+
+TRACE_VERSION = 1
+
+# 記録対象のハンドラと引数の種類
+EVENT_HANDLERS = ('on_mouse_press', 'on_mouse_drag', 'on_mouse_wheel', 'on_rotate_gesture')
+SLIDER_VARS = ('scale_x', 'scale_y', 'rotation', 'shear_x', 'shear_y')
+
+# 絶対値を持つため、処理が追いつかないとき最新のもの以外を間引けるハンドラ
+COALESCIBLE = ('on_mouse_drag', 'on_transform_change')
+
+
+# ================================================================
+# 記録
+# ================================================================
+
+class TraceRecorder:
+    """ImageTransformGUI のハンドラを差し替えて呼び出しを記録する"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'w', buffering=1)  # 行単位で書き出す（異常終了でも残る）
+        self._t0 = time.perf_counter()
+        self._header_written = False
+
+    def install(self, app):
+        """ハンドラをラップする。setup_ui でバインドされる前に呼ぶこと"""
+        for name in EVENT_HANDLERS:
+            self._wrap(app, name, lambda event: {
+                'x': event.x, 'y': event.y,
+                'delta': getattr(event, 'delta', 0), 'num': getattr(event, 'num', 0)})
+        self._wrap(app, 'on_transform_change', lambda *args: {
+            'values': {v: getattr(app, v).get() for v in SLIDER_VARS}})
+        self._wrap(app, 'move_order', lambda index, direction: {
+            'index': index, 'direction': direction})
+        self._wrap(app, 'open_image', lambda file_path: {'path': file_path})
+
+    def _wrap(self, app, name, describe):
+        original = getattr(app, name)
+
+        def wrapper(*args):
+            if not self._header_written:
+                # ウィンドウ表示後の実際のサイズを残す
+                self._write({'type': 'header', 'version': TRACE_VERSION,
+                             'geometry': app.root.geometry()})
+                self._header_written = True
+            record = {'type': 'event', 't': time.perf_counter() - self._t0, 'handler': name}
+            record.update(describe(*args))
+            self._write(record)
+            return original(*args)
+
+        setattr(app, name, wrapper)
+
+    def _write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def read_trace(path):
+    """トレースファイルを (ヘッダー, イベントのリスト) として読み込む"""
+    header = {}
+    events = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('type') == 'header':
+                header = record
+            else:
+                events.append(record)
+    return header, events
+
+
+# ================================================================
+# 再生
+# ================================================================
+
+def _dispatch(app, record):
+    """記録された1イベントを対応するハンドラに渡す"""
+    name = record['handler']
+    if name in EVENT_HANDLERS:
+        getattr(app, name)(SimpleNamespace(
+            x=record['x'], y=record['y'], delta=record['delta'], num=record['num']))
+    elif name == 'on_transform_change':
+        # 変数の更新でスライダーのコマンドが二重に走らないよう抑制してから設定
+        app._suppress_slider = True
+        for var, value in record['values'].items():
+            getattr(app, var).set(value)
+        app._suppress_slider = False
+        app.on_transform_change()
+    elif name == 'move_order':
+        app.move_order(record['index'], record['direction'])
+    elif name == 'open_image':
+        app.open_image(record['path'])
+
+
+def _flush_paint(app):
+    """保留中の描画を完了させる（スライダー変数の変更による再変換は抑制）"""
+    app._suppress_slider = True
+    try:
+        app.root.update_idletasks()
+    finally:
+        app._suppress_slider = False
+
+
+def replay(app, events, speed=1.0, realtime=True):
+    """トレースを再生し、イベントごとの計測結果を返す
+
+    realtime=True のときは記録時刻どおりにイベントを投入し、処理が追いつかない間に
+    次の同種イベントが届いた COALESCIBLE なイベントは間引いて「取りこぼし」として数える
+    """
+    app.ensure_panels_built()
+    _flush_paint(app)
+
+    results = []
+    dropped = 0
+    start = time.perf_counter()
+    for i, record in enumerate(events):
+        due = record['t'] / speed
+        if realtime:
+            # 投入時刻まで待つ（その間もTkのイベントは処理する）
+            while time.perf_counter() - start < due:
+                app.root.update()
+            nxt = events[i + 1] if i + 1 < len(events) else None
+            if (nxt is not None and record['handler'] in COALESCIBLE
+                    and nxt['handler'] == record['handler']
+                    and time.perf_counter() - start >= nxt['t'] / speed):
+                dropped += 1
+                continue
+
+        t_dispatch = time.perf_counter()
+        _dispatch(app, record)
+        _flush_paint(app)
+        t_painted = time.perf_counter()
+
+        results.append({
+            'handler': record['handler'],
+            'frame_ms': (t_painted - t_dispatch) * 1000.0,
+            'latency_ms': (t_painted - start - due) * 1000.0 if realtime
+            else (t_painted - t_dispatch) * 1000.0,
+        })
+
+    return results, dropped
+
+
+def summarize(results, dropped):
+    """計測結果から p50/p95/p99 を集計"""
+    def percentiles(values):
+        if not values:
+            return {'p50': None, 'p95': None, 'p99': None}
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {'p50': float(p50), 'p95': float(p95), 'p99': float(p99)}
+
+    per_handler = {}
+    for name in sorted({r['handler'] for r in results}):
+        subset = [r for r in results if r['handler'] == name]
+        per_handler[name] = {
+            'count': len(subset),
+            'frame_ms': percentiles([r['frame_ms'] for r in subset]),
+        }
+
+    return {
+        'events': len(results) + dropped,
+        'painted': len(results),
+        'dropped': dropped,
+        'frame_ms': percentiles([r['frame_ms'] for r in results]),
+        'latency_ms': percentiles([r['latency_ms'] for r in results]),
+        'handlers': per_handler,
+    }
+
+
+def print_summary(summary):
+    def fmt(p):
+        if p['p50'] is None:
+            return "-"
+        return f"p50 {p['p50']:.1f} / p95 {p['p95']:.1f} / p99 {p['p99']:.1f} ms"
+
+    print(f"イベント数: {summary['events']}（描画 {summary['painted']} / "
+          f"取りこぼし {summary['dropped']}）")
+    print(f"フレーム時間: {fmt(summary['frame_ms'])}")
+    print(f"イベント→描画: {fmt(summary['latency_ms'])}")
+    for name, h in summary['handlers'].items():
+        print(f"  {name:22s} {h['count']:5d} 件  {fmt(h['frame_ms'])}")
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+
+def main():
+    import tkinter as tk
+    from image_transform_gui import ImageTransformGUI
+
+    parser = argparse.ArgumentParser(description="操作トレースの記録と再生")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    rec = sub.add_parser('record', help="GUIを起動して操作を記録")
+    rec.add_argument('trace', help="書き出すトレースファイル")
+    rec.add_argument('--image', help="起動時に開く画像")
+
+    rep = sub.add_parser('replay', help="トレースを再生してレイテンシを計測")
+    rep.add_argument('trace', help="再生するトレースファイル")
+    rep.add_argument('--image', help="トレース内の画像パスを置き換える")
+    rep.add_argument('--speed', type=float, default=1.0, help="再生速度の倍率")
+    rep.add_argument('--no-realtime', action='store_true',
+                     help="待ち時間なしで全イベントを順に処理する")
+    rep.add_argument('--report', help="集計結果をJSONで書き出すファイル")
+    rep.add_argument('--max-p95', type=float, metavar='MS',
+                     help="フレーム時間のp95がこれを超えたら終了コード1で失敗")
+    rep.add_argument('--max-dropped', type=int,
+                     help="取りこぼしがこれを超えたら終了コード1で失敗")
+    rep.add_argument('--speculative', action='store_true',
+                     help="先読み描画を有効にして再生し、ヒット率を報告する")
+
+    args = parser.parse_args()
+
+    root = tk.Tk()
+    if args.command == 'record':
+        recorder = TraceRecorder(args.trace)
+        app = ImageTransformGUI(root, recorder=recorder)
+        if args.image:
+            root.after_idle(lambda: app.open_image(args.image))
+        try:
+            root.mainloop()
+        finally:
+            recorder.close()
+        return
+
+    header, events = read_trace(args.trace)
+    if args.image:
+        for record in events:
+            if record['handler'] == 'open_image':
+                record['path'] = args.image
+    if header.get('geometry'):
+        root.geometry(header['geometry'])
+    speculator = None
+    if args.speculative:
+        from speculative_render import SpeculativeRenderer
+        speculator = SpeculativeRenderer()
+    app = ImageTransformGUI(root, speculator=speculator)
+    root.update()
+
+    results, dropped = replay(app, events, speed=args.speed, realtime=not args.no_realtime)
+    summary = summarize(results, dropped)
+    print_summary(summary)
+    if speculator is not None:
+        summary['speculative'] = speculator.stats()
+        speculator.print_report()
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+    root.destroy()
+
+    failed = ((args.max_p95 is not None and summary['frame_ms']['p95'] is not None
+               and summary['frame_ms']['p95'] > args.max_p95)
+              or (args.max_dropped is not None and dropped > args.max_dropped))
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+出力サイズのメモリガバナー
+ワープ前に出力画像のバイト数を見積もり、予算を超える場合は
+プレビューを縮小し、書き出しをタイル単位のレンダリングに切り替える
+"""
+
+import math
+import os
+import tempfile
+
+import numpy as np
+
+import transform_core
+
+
+DEFAULT_PREVIEW_BUDGET = 256 << 20   # 256 MiB
+DEFAULT_EXPORT_BUDGET = 1 << 30      # 1 GiB
+
+# タイルの一辺（cv2.warpAffine の出力は各辺 SHRT_MAX 未満である必要があるため、それより十分小さく）
+DEFAULT_TILE_SIZE = 2048
+
+
+def estimate_output_bytes(out_w, out_h, channels=4, itemsize=1):
+    """出力画像のバイト数を見積もる"""
+    return int(out_w) * int(out_h) * channels * itemsize
+
+
+def format_bytes(n):
+    """バイト数を読みやすい単位の文字列にする"""
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if n < 1024 or unit == 'GB':
+            return f"{n:.0f} {unit}" if unit == 'B' else f"{n:.1f} {unit}"
+        n /= 1024.0
+
+
+class MemoryGovernor:
+    """プレビューと書き出しの出力メモリ予算を管理する"""
+
+    def __init__(self, preview_budget=DEFAULT_PREVIEW_BUDGET,
+                 export_budget=DEFAULT_EXPORT_BUDGET):
+        self.preview_budget = preview_budget
+        self.export_budget = export_budget
+
+    def preview_scale(self, out_w, out_h, channels=4, itemsize=1):
+        """プレビューを予算内に収める縮小率（収まるなら1.0）"""
+        nbytes = estimate_output_bytes(out_w, out_h, channels, itemsize)
+        if nbytes <= self.preview_budget:
+            return 1.0
+        return math.sqrt(self.preview_budget / nbytes)
+
+    def needs_tiling(self, out_w, out_h, channels=4, itemsize=1):
+        """書き出しをタイルレンダリングにすべきか"""
+        return estimate_output_bytes(out_w, out_h, channels, itemsize) > self.export_budget
+
+
+def scaled_transform(matrix, out_w, out_h, scale):
+    """出力を scale 倍に縮小する行列と出力サイズを返す"""
+    if scale >= 1.0:
+        return matrix, out_w, out_h
+    return (np.diag([scale, scale, 1.0]) @ matrix,
+            max(1, int(out_w * scale)), max(1, int(out_h * scale)))
+
+
+def render_tiled(src, matrix, out_w, out_h, out, tile_size=DEFAULT_TILE_SIZE, convert=None,
+                 alpha=True, filters=None, warp=None, tile_width=None, cancelled=None):
+    """出力をタイルごとにワープして out（ディスク上のメモリマップなど）へ書き込む
+
+    各タイルは平行移動を加えた行列でワープするので、全体を一度にワープした結果と丸め誤差（±1）の範囲で一致する。
+    tile_width を指定するとタイルの幅だけを変えられる（out_w なら全幅の帯）。
+    タイルは transform_core.warp_output と同じ形式（alpha=False なら不透明な画像はアルファなし）で、
+    warp(src, matrix, w, h) を指定するとそれでワープする。
+    filters（post_filters.FilterChain）を指定すると、周囲 filters.halo 画素を余分にワープしたタイルに
+    適用してから切り出す。convert を指定すると最後に各タイルに適用してから書き込む（例: RGBA→BGRA）。
+    cancelled() がタイルの間で真を返したら、描画を止めて None を返す
+    """
+    if warp is None:
+        def warp(s, m, w, h):
+            return transform_core.warp_output(s, m, w, h, alpha)
+
+    halo = filters.halo if filters else 0
+    tile_width = tile_width or tile_size
+    for y0 in range(0, out_h, tile_size):
+        th = min(tile_size, out_h - y0)
+        for x0 in range(0, out_w, tile_width):
+            if cancelled is not None and cancelled():
+                return None
+            tw = min(tile_width, out_w - x0)
+            shift = np.array([[1, 0, halo - x0], [0, 1, halo - y0], [0, 0, 1]], dtype=float)
+            tile = warp(src, shift @ matrix, tw + 2 * halo, th + 2 * halo)
+            if filters:
+                tile = filters(tile)[halo:halo + th, halo:halo + tw]
+            if convert is not None:
+                tile = convert(tile)
+            out[y0:y0 + th, x0:x0 + tw] = tile
+    return out
+
+
+def tiled_output_buffer(out_w, out_h, channels, dtype, directory=None):
+    """タイルレンダリング用にディスク上の一時メモリマップを作成
+
+    ページはファイルに裏付けられるため、物理メモリが足りなくてもスワップせずに書き出せる
+    """
+    fd, path = tempfile.mkstemp(suffix='.raw', dir=directory)
+    os.close(fd)
+    shape = (out_h, out_w) if channels == 1 else (out_h, out_w, channels)
+    buf = np.memmap(path, dtype=dtype, mode='w+', shape=shape)
+    os.unlink(path)  # マップが閉じられれば自動的に消える
+    return buf
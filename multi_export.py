@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+1回のレンダリングから複数サイズを書き出す
+フル解像度のワープは一度だけ行い、小さいサイズは直前のサイズからINTER_AREAで順に縮小して作る。
+各サイズのエンコードと書き込みは並列に行い、デコード済みの中間画像はディスクに書き出さない
+"""
+
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import image_cache
+import post_filters
+import transform_core
+
+
+# 書き出しプロファイル（size は長辺のピクセル数、None はフル解像度）
+DEFAULT_PROFILES = (
+    {'size': None, 'format': 'png', 'quality': None},
+    {'size': 1600, 'format': 'jpg', 'quality': 85},
+    {'size': 800, 'format': 'webp', 'quality': 80},
+    {'size': 320, 'format': 'jpg', 'quality': 80},
+)
+
+# アルファを保持できない形式（透明部分は落としてBGRで書き出す）
+OPAQUE_FORMATS = ('jpg', 'jpeg')
+
+# 品質を指定できる形式とその範囲（PNGは品質ではなく圧縮レベル）
+QUALITY_RANGES = {
+    'jpg': (0, 100),
+    'jpeg': (0, 100),
+    'webp': (1, 100),
+    'png': (0, 9),
+}
+
+
+# ================================================================
+# プロファイル
+# ================================================================
+
+def parse_profile(text):
+    """'SIZE:FORMAT[:QUALITY]' をプロファイルに変換（SIZE は長辺のピクセル数または full）
+
+    例: full:png, 1600:jpg:85, 800:webp:80
+    """
+    parts = text.split(':')
+    if len(parts) not in (2, 3) or not parts[1].strip('.'):
+        raise argparse.ArgumentTypeError("SIZE:FORMAT[:QUALITY] の形式で指定してください")
+    try:
+        size = None if parts[0] == 'full' else int(parts[0])
+        quality = int(parts[2]) if len(parts) == 3 else None
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"SIZE と QUALITY は整数で指定してください: {text}")
+    if size is not None and size <= 0:
+        raise argparse.ArgumentTypeError(f"SIZE は正の整数で指定してください: {text}")
+    fmt = parts[1].lower().lstrip('.')
+    if quality is not None:
+        if fmt not in QUALITY_RANGES:
+            raise argparse.ArgumentTypeError(f"{fmt} には品質を指定できません: {text}")
+        lo, hi = QUALITY_RANGES[fmt]
+        if not lo <= quality <= hi:
+            raise argparse.ArgumentTypeError(
+                f"{fmt} の品質は {lo}〜{hi} で指定してください"
+                f"{'（PNGは圧縮レベル）' if fmt == 'png' else ''}: {text}")
+    return {'size': size, 'format': fmt, 'quality': quality}
+
+
+def profile_path(base, profile):
+    """ベース名とプロファイルから出力パスを作る（例: out_1600.jpg、フル解像度は out.png）"""
+    suffix = '' if profile['size'] is None else f"_{profile['size']}"
+    return f"{base}{suffix}.{profile['format']}"
+
+
+def check_profiles(profiles):
+    """同じ出力パスになるプロファイル（サイズと形式が同じで品質だけ違うなど）があれば ValueError"""
+    seen = {}
+    for profile in profiles:
+        path = profile_path('', profile)
+        if path in seen:
+            raise ValueError(f"出力パスが重複するプロファイルがあります: {seen[path]} と {profile}")
+        seen[path] = profile
+
+
+# ================================================================
+# 縮小とエンコード
+# ================================================================
+
+def downscale_chain(image, sizes):
+    """長辺 sizes の各サイズを大きい順に (size, 画像) で返す
+
+    各サイズは元画像ではなく直前のサイズから INTER_AREA で縮小する。
+    元画像以上のサイズ（と None）は元画像をそのまま返す
+    """
+    import cv2
+
+    h, w = image.shape[:2]
+    long_edge = max(w, h)
+    current = image
+    for size in sorted(set(sizes), key=lambda s: -(long_edge if s is None else s)):
+        if size is None or size >= long_edge:
+            yield size, image
+            continue
+        scale = size / long_edge
+        dsize = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        current = cv2.resize(current, dsize, interpolation=cv2.INTER_AREA)
+        yield size, current
+
+
+def encode(image, fmt, quality=None):
+    """BGR(A)画像をメモリ上でエンコードしてバイト列を返す（形式が書き出せない型は変換する）"""
+    import cv2
+
+    fmt = fmt.lower()
+    if fmt in OPAQUE_FORMATS and image.ndim == 3 and image.shape[2] == 4:
+        image = cv2.cvtColor(image, cv2.COLOR_BGRA2BGR)
+    image = transform_core.fit_format_depth(image, fmt)
+
+    params = []
+    if quality is not None:
+        if fmt in ('jpg', 'jpeg'):
+            params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        elif fmt == 'webp':
+            params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+        elif fmt == 'png':
+            params = [cv2.IMWRITE_PNG_COMPRESSION, quality]  # 0〜9 の圧縮レベル
+
+    ok, buf = cv2.imencode('.' + fmt, image, params)
+    if not ok:
+        raise ValueError(f"エンコードに失敗しました: {fmt}")
+    return buf
+
+
+def export_profiles(image, base, profiles=DEFAULT_PROFILES, workers=None):
+    """レンダリング済みのBGR(A)画像を全プロファイルで書き出し、出力パスのリストを返す
+
+    縮小は大きいサイズから順に1本の連鎖で行い、各サイズができた時点で
+    そのサイズを使うプロファイルのエンコードと書き込みをワーカーに渡す
+    """
+    check_profiles(profiles)
+    by_size = {}
+    for profile in profiles:
+        by_size.setdefault(profile['size'], []).append(profile)
+
+    def write(level, profile):
+        path = profile_path(base, profile)
+        buf = encode(level, profile['format'], profile['quality'])
+        with open(path, 'wb') as f:
+            f.write(buf)
+        return path
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = [pool.submit(write, level, profile)
+                   for size, level in downscale_chain(image, by_size)
+                   for profile in by_size[size]]
+        return [f.result() for f in futures]
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="変換結果を複数のサイズ・形式で書き出す")
+    parser.add_argument('input', help="入力画像")
+    parser.add_argument('base', help="出力のベース名（例: out → out.png, out_1600.jpg ...）")
+    parser.add_argument('--profile', type=parse_profile, action='append', metavar='SPEC',
+                        help="SIZE:FORMAT[:QUALITY]（複数指定可、省略時は既定のプロファイル）")
+    parser.add_argument('--scale-x', type=float, default=1.0, dest='sx')
+    parser.add_argument('--scale-y', type=float, default=1.0, dest='sy')
+    parser.add_argument('--rotation', type=float, default=0.0, dest='angle_deg')
+    parser.add_argument('--shear-x', type=float, default=0.0, dest='hx')
+    parser.add_argument('--shear-y', type=float, default=0.0, dest='hy')
+    parser.add_argument('--order', default=','.join(transform_core.DEFAULT_ORDER),
+                        help="適用順序（カンマ区切り）")
+    parser.add_argument('--filters', metavar='SPEC',
+                        help="後処理フィルタ（例: sharpen:amount=0.8,gamma:2.2）")
+    parser.add_argument('--workers', type=int)
+    image_cache.add_arguments(parser)
+    args = parser.parse_args()
+    profiles = args.profile or DEFAULT_PROFILES
+    try:
+        check_profiles(profiles)
+    except ValueError as e:
+        parser.error(str(e))
+
+    try:
+        chain = post_filters.parse_chain(args.filters)
+    except (ValueError, TypeError) as e:
+        raise SystemExit(f"フィルタの指定が正しくありません: {e}")
+    try:
+        image = image_cache.read_image(args.input, image_cache.from_args(args))
+    except ValueError as e:
+        raise SystemExit(f"{e}: {args.input}")
+
+    h, w = image.shape[:2]
+    matrices = transform_core.build_individual_matrices(
+        args.sx, args.sy, args.angle_deg, args.hx, args.hy)
+    order = [k.strip() for k in args.order.split(',')]
+    matrix, out_w, out_h = transform_core.build_transform(w, h, matrices, order)
+    alpha = any(transform_core.format_has_alpha(p['format']) for p in profiles)
+    out = transform_core.to_bgr(
+        post_filters.render_output(image, matrix, out_w, out_h, chain, alpha))
+
+    paths = export_profiles(out, args.base, profiles, args.workers)
+    for path in paths:
+        print(f"保存しました: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+ワープ後のフィルタチェーン（シャープ・ガンマ/レベル・グレースケール）
+出力を全幅の帯に分け、帯ごとにワープした直後にフィルタを続けて適用する。
+近傍を使うフィルタのために帯の周囲を余分にワープしてから切り出すので、
+フィルタ前のフル解像度画像は作られない
+
+チェーンは 'sharpen:amount=0.8:sigma=1,gamma:2.2,grayscale' のような文字列で指定する
+"""
+
+import inspect
+import math
+
+import numpy as np
+
+import memory_governor
+import transform_core
+
+
+# フィルタ付きで描画するときの帯の行数（全幅×この行数ずつワープしてフィルタをかける）。
+# 正方形のタイルより halo の重なりが少なく、ワープの書き込みも連続する
+BAND_ROWS = 64
+
+
+# ================================================================
+# フィルタ
+# ================================================================
+# 各フィルタはタイル（帯。RGB(A)順、またはグレー）を受け取り、同じ形状・型のタイルを返す。
+# 4番目のチャンネル（アルファ）は変更しない。halo は必要な周囲の画素数
+
+class Filter:
+    name = None
+    halo = 0
+
+    def __init__(self, **params):
+        self.params = params
+
+    def __call__(self, tile):
+        raise NotImplementedError
+
+    def spec(self):
+        return ':'.join([self.name] + [f"{k}={v:g}" for k, v in self.params.items()])
+
+
+class Levels(Filter):
+    """レベル補正: black〜white（0〜1の割合）を0〜最大値に引き伸ばし、ガンマをかける"""
+    name = 'levels'
+
+    def __init__(self, black=0.0, white=1.0, gamma=1.0):
+        if not white > black:
+            raise ValueError("levels: white は black より大きくしてください")
+        if not gamma > 0:
+            raise ValueError(f"{self.name}: gamma は正の値で指定してください")
+        super().__init__(black=black, white=white, gamma=gamma)
+        self._luts = {}   # 整数型 → ルックアップテーブル（タイルごとに作り直さない）
+
+    def curve(self, x):
+        p = self.params
+        return np.clip((x - p['black']) / (p['white'] - p['black']), 0.0, 1.0) ** (1.0 / p['gamma'])
+
+    def __call__(self, tile):
+        import cv2
+
+        color = tile if tile.ndim == 2 else tile[..., :3]
+        if np.issubdtype(tile.dtype, np.floating):
+            color[...] = self.curve(color)
+            return tile
+
+        # 整数型は全階調のルックアップテーブルで変換
+        lut = self._luts.get(tile.dtype)
+        if lut is None:
+            top = transform_core.dtype_max(tile.dtype)
+            lut = np.rint(self.curve(np.arange(top + 1) / top) * top).astype(tile.dtype)
+            self._luts[tile.dtype] = lut
+        if tile.dtype == np.uint8:
+            # チャンネル共通のテーブルの方がチャンネル別より速いので、全チャンネルに適用してアルファを戻す
+            out = cv2.LUT(tile, lut)
+            if tile.ndim == 3 and tile.shape[2] == 4:
+                out[..., 3] = tile[..., 3]
+            return out
+        color[...] = lut[color]
+        return tile
+
+
+class Gamma(Levels):
+    """ガンマ補正（gamma > 1 で明るく）"""
+    name = 'gamma'
+
+    def __init__(self, gamma=2.2):
+        super().__init__(gamma=gamma)
+
+    def spec(self):
+        return f"{self.name}:gamma={self.params['gamma']:g}"
+
+
+class Grayscale(Filter):
+    """グレースケール化（チャンネル構成は変えず R=G=B にする）"""
+    name = 'grayscale'
+
+    def __init__(self):
+        super().__init__()
+
+    def __call__(self, tile):
+        import cv2
+
+        if tile.ndim == 2:
+            return tile
+        code = cv2.COLOR_RGBA2GRAY if tile.shape[2] == 4 else cv2.COLOR_RGB2GRAY
+        gray = cv2.cvtColor(tile, code)
+        tile[..., :3] = gray[..., None]
+        return tile
+
+
+class Sharpen(Filter):
+    """アンシャープマスク: 元 + amount × (元 − ぼかし)"""
+    name = 'sharpen'
+
+    def __init__(self, amount=1.0, sigma=1.0):
+        if not sigma > 0:
+            raise ValueError("sharpen: sigma は正の値で指定してください")
+        if not math.isfinite(amount):
+            raise ValueError("sharpen: amount は有限の値で指定してください")
+        super().__init__(amount=amount, sigma=sigma)
+        self.halo = int(math.ceil(4 * sigma))
+
+    def __call__(self, tile):
+        import cv2
+
+        amount, sigma = self.params['amount'], self.params['sigma']
+        blurred = cv2.GaussianBlur(tile, (0, 0), sigma)
+        out = cv2.addWeighted(tile, 1.0 + amount, blurred, -amount, 0, dst=blurred)
+        if tile.ndim == 3 and tile.shape[2] == 4:
+            out[..., 3] = tile[..., 3]
+        return out
+
+
+# 名前 → フィルタクラス（新しいフィルタはここに登録する）
+FILTERS = {cls.name: cls for cls in (Sharpen, Levels, Gamma, Grayscale)}
+
+
+# ================================================================
+# チェーン
+# ================================================================
+
+class FilterChain:
+    """フィルタを順に適用する。halo は各フィルタの halo の合計"""
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.halo = sum(f.halo for f in self.filters)
+
+    def __call__(self, tile):
+        for f in self.filters:
+            tile = f(tile)
+        return tile
+
+    def __bool__(self):
+        return bool(self.filters)
+
+    def spec(self):
+        return ','.join(f.spec() for f in self.filters)
+
+
+def parse_chain(text):
+    """'name:arg=value:...,name,...' をフィルタチェーンに変換（空文字列なら None）
+
+    引数は名前付きのほか、先頭から順に値だけを書いてもよい（例: gamma:2.2）。
+    引数の名前・個数・値が正しくなければ描画を始める前に ValueError にする
+    """
+    filters = []
+    for part in (text or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, *args = part.split(':')
+        if name not in FILTERS:
+            raise ValueError(f"不明なフィルタ: {name}（{', '.join(FILTERS)}）")
+        cls = FILTERS[name]
+        try:
+            positional = [float(a) for a in args if '=' not in a]
+            named = {k: float(v) for k, v in (a.split('=', 1) for a in args if '=' in a)}
+        except ValueError:
+            raise ValueError(f"{name}: 引数は数値で指定してください: {part}")
+        signature = inspect.signature(cls)
+        try:
+            signature.bind(*positional, **named)
+        except TypeError:
+            usage = ', '.join(signature.parameters) or "なし"
+            raise ValueError(f"{name}: 引数が正しくありません（使える引数: {usage}）: {part}")
+        filters.append(cls(*positional, **named))
+    return FilterChain(filters) if filters else None
+
+
+# ================================================================
+# フィルタ付きの描画
+# ================================================================
+
+def render_preview(src, matrix, out_w, out_h, chain=None, background=(0, 0, 0), cancelled=None):
+    """transform_core.warp_preview と同じ画像にフィルタを適用して返す
+
+    cancelled を指定すると（フィルタがなくても）帯ごとに描画し、帯の間で cancelled() が
+    真を返したら途中で止めて None を返す
+    """
+    if not chain and cancelled is None:
+        return transform_core.warp_preview(src, matrix, out_w, out_h, background)
+    channels = transform_core.preview_channels(src, background)
+    out = np.empty((out_h, out_w) if channels == 1 else (out_h, out_w, channels), src.dtype)
+    # 帯ごとに変換しないよう、透明な余白で描くものは先に一度だけ4チャンネルにする
+    if background is not None and transform_core.is_opaque(src):
+        def warp(s, m, w, h):
+            return transform_core.warp_color(s, m, w, h, background)
+    else:
+        warp = transform_core.warp_rgba
+        src = transform_core.to_rgba(src)
+    return memory_governor.render_tiled(
+        src, matrix, out_w, out_h, out, BAND_ROWS, filters=chain, tile_width=out_w, warp=warp,
+        cancelled=cancelled)
+
+
+def render_output(src, matrix, out_w, out_h, chain=None, alpha=True, out=None, convert=None):
+    """transform_core.warp_output と同じ画像にフィルタを適用して返す（convert は最後に各タイルへ適用）
+
+    out にディスク上のメモリマップを渡せば、予算を超える出力もそのまま書き出せる
+    """
+    if not chain and out is None:
+        image = transform_core.warp_output(src, matrix, out_w, out_h, alpha)
+        return image if convert is None else convert(image)
+    if out is None:
+        channels = transform_core.output_channels(src, alpha)
+        out = np.empty((out_h, out_w) if channels == 1 else (out_h, out_w, channels), src.dtype)
+    return memory_governor.render_tiled(
+        src, matrix, out_w, out_h, out, BAND_ROWS, convert=convert, alpha=alpha,
+        filters=chain, tile_width=out_w)
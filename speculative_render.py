@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+次に選ばれそうな状態の投機的な先読み描画
+回転プリセット・スケールリセット・操作中のスライダーの±1刻みを、操作が途切れた間に
+プレビュー解像度でバックグラウンド描画し、上限付きのキャッシュに置いておく。
+ユーザーが操作したら描画中の候補も帯の区切りで止め、ヒット率を集計して報告する
+"""
+
+import queue
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+import memory_governor
+import post_filters
+import transform_core
+
+
+DEFAULT_MAX_BYTES = 256 << 20   # 256 MiB
+
+# 最後の描画・操作からこの時間操作がなければ先読みを始める
+IDLE_DELAY_MS = 150
+
+# 先読みを止めるユーザー操作
+INTERACTION_EVENTS = ('<ButtonPress>', '<KeyPress>', '<MouseWheel>', '<B1-Motion>')
+
+# スライダー変数 → transform_core.build_individual_matrices の引数
+PARAM_OF_VAR = {
+    'scale_x': 'sx',
+    'scale_y': 'sy',
+    'rotation': 'angle_deg',
+    'shear_x': 'hx',
+    'shear_y': 'hy',
+}
+
+# 候補の種類（recent は先読みではなく実際に描画した結果）
+KIND_LABELS = {
+    'step': "スライダー±1刻み",
+    'preset': "回転プリセット",
+    'reset_scale': "スケールリセット",
+    'recent': "直近の描画",
+}
+
+
+class SpeculativeRenderer:
+    """ImageTransformGUI のプレビュー描画を先読みするキャッシュ"""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, idle_delay_ms=IDLE_DELAY_MS):
+        self.max_bytes = max_bytes
+        self.idle_delay_ms = idle_delay_ms
+        self.app = None
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()   # キー → (プレビュー画像, 種類)
+        self._bytes = 0
+        self._token = 0               # 画像を開き直すたびに変わる（古い画像の結果を捨てる）
+        self._generation = 0          # 操作のたびに変わる（先読みを次の候補に進めない）
+        self._jobs = queue.Queue()
+        self._timer = None
+
+        # 操作中のスライダー（±1刻みの候補に使う）
+        self._active = None
+        self._last_values = None
+
+        self.lookups = 0
+        self.hits = Counter()
+        self.rendered = Counter()
+
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def install(self, app):
+        """ユーザー操作で先読みを止めるようにバインドする"""
+        self.app = app
+        for sequence in INTERACTION_EVENTS:
+            app.root.bind_all(sequence, self.interrupt, add='+')
+
+    # ---- キャッシュ ----
+
+    @staticmethod
+    def key(matrix, pw, ph):
+        """プレビューの変換行列と出力サイズからキャッシュのキーを作る"""
+        return np.round(np.asarray(matrix, dtype=float)[:2], 6).tobytes(), pw, ph
+
+    def lookup(self, matrix, pw, ph):
+        """描画済みのプレビューがあれば返す（なければ None）"""
+        k = self.key(matrix, pw, ph)
+        self.lookups += 1
+        with self._lock:
+            entry = self._cache.get(k)
+            if entry is not None:
+                self._cache.move_to_end(k)
+        if entry is None:
+            return None
+        self.hits[entry[1]] += 1
+        return entry[0]
+
+    def store(self, matrix, pw, ph, image):
+        """実際に描画したプレビューも置いておく（同じ状態への再描画を省く）"""
+        with self._lock:
+            self._put(self.key(matrix, pw, ph), image, 'recent', self._token)
+
+    def _put(self, k, image, kind, token):
+        # ロックを取った状態で呼ぶこと
+        if token != self._token or k in self._cache or image.nbytes > self.max_bytes:
+            return
+        self._cache[k] = (image, kind)
+        self._bytes += image.nbytes
+        while self._bytes > self.max_bytes:
+            _, (old, _) = self._cache.popitem(last=False)
+            self._bytes -= old.nbytes
+
+    def clear(self):
+        """画像を開き直したとき・フィルタを変えたときに呼ぶ"""
+        with self._lock:
+            self._token += 1
+            self._cache.clear()
+            self._bytes = 0
+        self._generation += 1
+        self._active = None
+        self._last_values = None
+
+    # ---- スケジュール ----
+
+    def interrupt(self, event=None):
+        """ユーザー操作: 描画中の先読みを止め、操作が途切れたら改めて始める"""
+        self._generation += 1
+        self._rearm()
+
+    def schedule(self):
+        """プレビューを描画した後に呼ぶ"""
+        values = self._slider_values()
+        if self._last_values is not None:
+            changed = [v for v in values if values[v] != self._last_values[v]]
+            if len(changed) == 1:
+                self._active = changed[0]
+        self._last_values = values
+        self._rearm()
+
+    def _rearm(self):
+        if self.app is None:
+            return
+        if self._timer is not None:
+            self.app.root.after_cancel(self._timer)
+        self._timer = self.app.root.after(self.idle_delay_ms, self._start)
+
+    def _slider_values(self):
+        return {v: float(getattr(self.app, v).get()) for v in PARAM_OF_VAR}
+
+    def candidates(self):
+        """次に選ばれそうな状態を優先度順に (種類, スライダー値) で返す"""
+        values = self._slider_values()
+        out = []
+        if self._active is not None:
+            r = self.app.SLIDER_RANGES[self._active]
+            for sign in (1, -1):
+                v = values[self._active] + sign * r['resolution']
+                if r['from_'] - 1e-9 <= v <= r['to'] + 1e-9:
+                    out.append(('step', dict(values, **{self._active: v})))
+        for angle in self.app.ROTATION_PRESETS:
+            out.append(('preset', dict(values, rotation=float(angle))))
+        out.append(('reset_scale', dict(values, scale_x=1.0, scale_y=1.0)))
+        return out
+
+    def _start(self):
+        """候補の行列とプレビューサイズを計算し、未描画のものをワーカーに渡す"""
+        self._timer = None
+        app = self.app
+        src = app.preview_source
+        if src is None:
+            return
+        h, w = src.shape[:2]
+        background = app.CANVAS_BG_RGB
+
+        # 優先度の低い候補が高い候補を追い出さないよう、キャッシュに収まる分だけ描画する
+        jobs = []
+        keys = set()
+        planned = 0
+        for kind, values in self.candidates():
+            matrices = transform_core.build_individual_matrices(
+                **{PARAM_OF_VAR[v]: x for v, x in values.items()})
+            matrix, out_w, out_h = transform_core.build_transform(
+                w, h, matrices, app.transform_order)
+            channels = transform_core.preview_channels(src, background)
+            scale = app.governor.preview_scale(out_w, out_h, channels, src.itemsize)
+            m, pw, ph = memory_governor.scaled_transform(matrix, out_w, out_h, scale)
+            k = self.key(m, pw, ph)
+            with self._lock:
+                cached = k in self._cache
+            if cached or k in keys:
+                continue
+            planned += memory_governor.estimate_output_bytes(pw, ph, channels, src.itemsize)
+            if planned > self.max_bytes:
+                break
+            keys.add(k)
+            jobs.append((kind, k, m, pw, ph))
+        if jobs:
+            self._jobs.put((self._generation, self._token, src, app.filters,
+                            background, jobs))
+
+    def _worker(self):
+        while True:
+            generation, token, src, filters, background, jobs = self._jobs.get()
+            for kind, k, m, pw, ph in jobs:
+                if generation != self._generation:
+                    break  # 操作があった
+                with self._lock:
+                    if k in self._cache:
+                        continue  # 先に投入された候補で描画済み
+                # 操作があれば描画中の候補も帯の区切りで止めて捨てる
+                image = post_filters.render_preview(
+                    src, m, pw, ph, filters, background,
+                    cancelled=lambda: generation != self._generation)
+                if image is None:
+                    break
+                with self._lock:
+                    self._put(k, image, kind, token)
+                self.rendered[kind] += 1
+
+    # ---- 集計 ----
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        return {
+            'lookups': self.lookups,
+            'hits': hits,
+            'hit_rate': hits / self.lookups if self.lookups else None,
+            'hits_by_kind': dict(self.hits),
+            'rendered_by_kind': dict(self.rendered),
+            'cached_bytes': self._bytes,
+        }
+
+    def print_report(self):
+        s = self.stats()
+        rate = "-" if s['hit_rate'] is None else f"{s['hit_rate'] * 100:.0f}%"
+        print(f"先読み描画: ヒット {s['hits']}/{s['lookups']}（{rate}）")
+        for kind, label in KIND_LABELS.items():
+            hits = self.hits.get(kind, 0)
+            if kind == 'recent':
+                print(f"  {label:12s} ヒット {hits} 件")
+            else:
+                print(f"  {label:12s} 先読み {self.rendered.get(kind, 0)} 件 / ヒット {hits} 件")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+多バンド・マルチページ画像のスタックワープ
+マルチスペクトル画像（8〜200バンド）の全バンドに同じ変換を適用する。
+スタックはマルチページTIFFと同じバンド優先の (B, H, W) 配列で扱い、
+変換行列と出力サイズは一度だけ計算して全バンドで共有し、4バンドずつのグループを並列にワープする。
+TIFF はグループごとに必要なページだけを読み、結果はディスク上のスタックへ順に書き込むので、
+入力・出力のスタック全体をメモリに置かない
+"""
+
+import argparse
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import transform_core
+
+
+# 1回のワープで処理するバンド数（cv2.warpAffine が扱える最大チャンネル数）
+# 4チャンネルのワープは1チャンネルと比べてわずかな増分で済むため、まとめるほど速い
+DEFAULT_GROUP = 4
+
+
+# ================================================================
+# ワープ
+# ================================================================
+
+def warp_stack(stack, matrix, out_w, out_h, group=DEFAULT_GROUP, workers=None, out=None):
+    """(B, H, W) のスタック全バンドに同じアフィン変換を適用して (B, out_h, out_w) を返す
+
+    変換行列と出力サイズは呼び出し側で一度だけ計算し、全バンドで共有する。
+    stack に PageStack を渡すと、各グループのバンドをワープの直前にファイルから読む。
+    out に np.lib.format.open_memmap などを渡すと、結果をディスク上のスタックへ直接書き込む
+    """
+    import cv2
+
+    if not isinstance(stack, PageStack):
+        stack = np.asarray(stack)
+        if stack.ndim == 2:
+            stack = stack[None]
+    bands = stack.shape[0]
+    if not 1 <= group <= 4:
+        raise ValueError("group は 1〜4 で指定してください")
+
+    if out is None:
+        out = np.empty((bands, out_h, out_w), dtype=stack.dtype)
+    elif out.shape != (bands, out_h, out_w):
+        raise ValueError(f"出力スタックの形状が違います: {out.shape}")
+
+    transform_2x3 = np.asarray(matrix, dtype=float)[:2, :]
+
+    # 2チャンネルのワープだけは補間経路が異なり1バンドずつの結果とずれるため、
+    # 端数が2バンドになるグループは1バンドずつに分ける
+    ranges = []
+    for start in range(0, bands, group):
+        stop = min(start + group, bands)
+        if stop - start == 2:
+            ranges += [(start, start + 1), (start + 1, stop)]
+        else:
+            ranges.append((start, stop))
+
+    def warp_group(span):
+        # 連続したバンド面をまとめて1回でワープし、出力の各面へ書き戻す
+        start, stop = span
+        if isinstance(stack, PageStack):
+            planes = stack.planes(start, stop)
+        else:
+            planes = [stack[b] for b in range(start, stop)]
+        src = cv2.merge(planes)
+        warped = cv2.warpAffine(src, transform_2x3, (out_w, out_h),
+                                flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        if warped.ndim == 2:
+            out[start] = warped
+        else:
+            out[start:stop] = warped.transpose(2, 0, 1)
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        list(pool.map(warp_group, ranges))
+
+    return out
+
+
+# ================================================================
+# 読み書き
+# ================================================================
+
+class PageStack:
+    """マルチページTIFFを (B, H, W) のスタックとして扱い、ページは必要になったときに読む
+
+    多チャンネルのページはチャンネルごとに別バンドとして展開する（全ページ同じ形状・型であること）
+    """
+
+    def __init__(self, path):
+        import cv2
+
+        self.path = path
+        pages = cv2.imcount(path)
+        ok, first = cv2.imreadmulti(path, 0, 1, flags=cv2.IMREAD_UNCHANGED)
+        if not pages or not ok or not first:
+            raise ValueError("画像を読み込めませんでした")
+        page = first[0]
+        self.channels = page.shape[2] if page.ndim == 3 else 1
+        self.page_shape = page.shape
+        self.dtype = page.dtype
+        self.shape = (pages * self.channels,) + page.shape[:2]
+
+    def planes(self, start, stop):
+        """バンド start〜stop-1 を含むページだけを読み、バンドごとの2次元配列のリストで返す"""
+        import cv2
+
+        first, last = start // self.channels, (stop - 1) // self.channels
+        ok, pages = cv2.imreadmulti(self.path, first, last - first + 1,
+                                    flags=cv2.IMREAD_UNCHANGED)
+        if not ok or len(pages) != last - first + 1:
+            raise ValueError(f"ページを読み込めませんでした: {first}〜{last}")
+        planes = []
+        for page in pages:
+            if page.shape != self.page_shape or page.dtype != self.dtype:
+                raise ValueError("ページごとに形状か型が違います")
+            planes.extend(cv2.split(page) if page.ndim == 3 else [page])
+        offset = first * self.channels
+        return planes[start - offset:stop - offset]
+
+
+def read_stack(path):
+    """.npy はメモリマップ、マルチページTIFFは PageStack として (B, H, W) のスタックを開く"""
+    if path.endswith('.npy'):
+        stack = np.load(path, mmap_mode='r')
+        return stack[None] if stack.ndim == 2 else stack
+    return PageStack(path)
+
+
+def open_output_stack(path, out_w, out_h, bands, dtype):
+    """出力先のスタックをディスク上のメモリマップとして用意
+
+    .npy ならそのファイル、それ以外は出力先と同じディレクトリの一時ファイル
+    （開いた直後に削除するので、マップが閉じられれば自動的に消える）
+    """
+    shape = (bands, out_h, out_w)
+    if path.endswith('.npy'):
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    fd, tmp = tempfile.mkstemp(suffix='.raw', dir=os.path.dirname(os.path.abspath(path)))
+    os.close(fd)
+    stack = np.memmap(tmp, dtype=dtype, mode='w+', shape=shape)
+    os.unlink(tmp)
+    return stack
+
+
+def write_stack(path, stack):
+    """スタックを保存（.npy 以外はバンドごとに1ページのマルチページ画像）"""
+    if path.endswith('.npy'):
+        if isinstance(stack, np.memmap):
+            stack.flush()
+            return
+        np.save(path, stack)
+        return
+
+    import cv2
+
+    if not cv2.imwritemulti(path, list(stack)):
+        raise ValueError(f"保存に失敗しました: {path}")
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="多バンド画像の全バンドに同じ変換を適用")
+    parser.add_argument('input', help="入力（マルチページTIFF または (B, H, W) の .npy）")
+    parser.add_argument('output', help="出力（.npy ならディスクへ直接書き込み）")
+    parser.add_argument('--scale-x', type=float, default=1.0, dest='sx')
+    parser.add_argument('--scale-y', type=float, default=1.0, dest='sy')
+    parser.add_argument('--rotation', type=float, default=0.0, dest='angle_deg')
+    parser.add_argument('--shear-x', type=float, default=0.0, dest='hx')
+    parser.add_argument('--shear-y', type=float, default=0.0, dest='hy')
+    parser.add_argument('--order', default=','.join(transform_core.DEFAULT_ORDER),
+                        help="適用順序（カンマ区切り）")
+    parser.add_argument('--group', type=int, default=DEFAULT_GROUP,
+                        help="1回のワープで処理するバンド数（1〜4）")
+    parser.add_argument('--workers', type=int)
+    args = parser.parse_args()
+
+    stack = read_stack(args.input)
+    bands, h, w = stack.shape
+    matrices = transform_core.build_individual_matrices(
+        args.sx, args.sy, args.angle_deg, args.hx, args.hy)
+    order = [k.strip() for k in args.order.split(',')]
+    matrix, out_w, out_h = transform_core.build_transform(w, h, matrices, order)
+
+    out = open_output_stack(args.output, out_w, out_h, bands, stack.dtype)
+    warp_stack(stack, matrix, out_w, out_h, group=args.group, workers=args.workers, out=out)
+    write_stack(args.output, out)
+    print(f"{bands} バンドを変換しました: {args.output}（{out_w}x{out_h}）")
+
+
+if __name__ == "__main__":
+    main()
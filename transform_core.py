@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+"""
+行列変換のコアロジック
+GUI（Tk）に依存せず、変換行列と出力サイズはnumpyだけで計算する
+（OpenCVは画像の読み込み・ワープを初めて呼んだときに読み込む）
+"""
+
+import json
+import math
+import os
+import re
+
+import numpy as np
+
+
+# 変換キーの既定の適用順序（先頭が最初に適用）
+DEFAULT_ORDER = ('scale', 'rotation', 'shear')
+
+
+# ================================================================
+# 行列構築
+# ================================================================
+
+def build_individual_matrices(sx=1.0, sy=1.0, angle_deg=0.0, hx=0.0, hy=0.0):
+    """スライダー値から各変換の3x3行列を構築"""
+    a = math.radians(angle_deg)
+    c, s = math.cos(a), math.sin(a)
+    return {
+        'scale': np.array([
+            [sx, 0, 0],
+            [0, sy, 0],
+            [0, 0, 1]
+        ], dtype=float),
+        'rotation': np.array([
+            [c, -s, 0],
+            [s,  c, 0],
+            [0,  0, 1]
+        ], dtype=float),
+        'shear': np.array([
+            [1,  hx, 0],
+            [hy,  1, 0],
+            [0,   0, 1]
+        ], dtype=float),
+    }
+
+
+def compose(matrices, order=DEFAULT_ORDER):
+    """適用順序に従って行列を合成（先頭が最初に適用）"""
+    combined = np.eye(3)
+    for key in order:
+        combined = matrices[key] @ combined
+    return combined
+
+
+def centered(linear, w, h):
+    """画像中心を原点として変換する完全な行列: 中心に移動 → 変換 → 戻す"""
+    cx, cy = w / 2.0, h / 2.0
+    to_origin = np.array([[1, 0, -cx], [0, 1, -cy], [0, 0, 1]])
+    from_origin = np.array([[1, 0, cx], [0, 1, cy], [0, 0, 1]])
+    return from_origin @ linear @ to_origin
+
+
+def compute_output_bounds(w, h, combined_linear):
+    """変換後の四隅から必要な出力サイズとオフセットを計算"""
+    corners = np.array([
+        [0, 0, 1],
+        [w, 0, 1],
+        [w, h, 1],
+        [0, h, 1]
+    ], dtype=float).T  # 3x4
+
+    transformed = combined_linear @ corners  # 3x4
+    xs = transformed[0]
+    ys = transformed[1]
+
+    min_x, max_x = xs.min(), xs.max()
+    min_y, max_y = ys.min(), ys.max()
+
+    # パディングを追加
+    pad = max(w, h) * 0.25
+    min_x -= pad
+    min_y -= pad
+    max_x += pad
+    max_y += pad
+
+    out_w = int(math.ceil(max_x - min_x))
+    out_h = int(math.ceil(max_y - min_y))
+
+    return out_w, out_h, min_x, min_y
+
+
+def fit_to_output(w, h, full):
+    """出力画像内に収まるよう平行移動を追加し、最終行列と出力サイズを返す"""
+    out_w, out_h, min_x, min_y = compute_output_bounds(w, h, full)
+    offset = np.array([[1, 0, -min_x], [0, 1, -min_y], [0, 0, 1]])
+    return offset @ full, out_w, out_h
+
+
+def build_transform(w, h, matrices, order=DEFAULT_ORDER):
+    """個別行列と適用順序から最終変換行列と出力サイズを計算"""
+    full = centered(compose(matrices, order), w, h)
+    return fit_to_output(w, h, full)
+
+
+# ================================================================
+# パイプラインの保存
+# ================================================================
+
+def save_pipeline(path, matrices, order=DEFAULT_ORDER, filters=None):
+    """各変換の行列と適用順序（と後処理フィルタの指定文字列）をJSONで保存"""
+    data = {
+        'transform_order': list(order),
+        'matrices': {k: np.asarray(m, dtype=float).tolist() for k, m in matrices.items()},
+    }
+    if filters:
+        data['filters'] = filters
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+
+
+def load_pipeline(path):
+    """保存したパイプラインを (行列の辞書, 適用順序, フィルタの指定文字列またはNone) として読み込む
+
+    'matrices' の代わりに build_individual_matrices の引数を 'params' で書いてもよい
+    """
+    with open(path) as f:
+        data = json.load(f)
+    order = data.get('transform_order', list(DEFAULT_ORDER))
+    if 'matrices' in data:
+        matrices = {k: np.array(m, dtype=float) for k, m in data['matrices'].items()}
+    else:
+        matrices = build_individual_matrices(**data.get('params', {}))
+    missing = [k for k in order if k not in matrices]
+    if missing:
+        raise ValueError(f"パイプラインに行列がありません: {missing}")
+    return matrices, order, data.get('filters')
+
+
+# ================================================================
+# 画像の読み書き
+# ================================================================
+
+def read_image(path):
+    """画像をデコードしてRGB/RGBA（グレーはそのまま）の配列で返す"""
+    import cv2
+
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("画像を読み込めませんでした")
+    if image.ndim == 3:
+        if image.shape[2] == 4:
+            image = cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+        else:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return image
+
+
+# ================================================================
+# ビット深度
+# ================================================================
+
+# 出力形式ごとに書き出せる型（ここにない形式は8bitのみ）
+FORMAT_DTYPES = {
+    'png': (np.uint8, np.uint16),
+    'tif': (np.uint8, np.uint16, np.float32),
+    'tiff': (np.uint8, np.uint16, np.float32),
+}
+
+# プレビュー用の8bit画像で、1を超える浮動小数（HDR）の白とみなす上位の割合（%）
+HDR_WHITE_PERCENTILE = 99.9
+
+
+def dtype_max(dtype):
+    """型ごとの不透明値・白の値（整数は最大値、浮動小数は1.0）"""
+    return np.iinfo(dtype).max if np.issubdtype(dtype, np.integer) else 1.0
+
+
+def convert_depth(image, dtype):
+    """値域（整数は0〜最大値、浮動小数は0〜1）を合わせて型を変換する"""
+    dtype = np.dtype(dtype)
+    scale = dtype_max(dtype) / dtype_max(image.dtype)
+    if np.issubdtype(dtype, np.floating):
+        return image.astype(dtype) * dtype.type(scale)
+    scaled = image.astype(np.float32) * np.float32(scale)
+    return np.clip(scaled + 0.5, 0, dtype_max(dtype)).astype(dtype)
+
+
+def fit_format_depth(image, path_or_ext):
+    """出力形式が書き出せない型なら、書き出せる中で最も近い型に変換する
+
+    cv2.imwrite は対応しない型を値域を合わせずに8bitへ落とすため、書き出す前に呼ぶ。
+    浮動小数はTIFFならfloat32、PNGなら16bit、それ以外は8bitになる
+    """
+    ext = (os.path.splitext(path_or_ext)[1] or path_or_ext).lower().lstrip('.')
+    dtypes = FORMAT_DTYPES.get(ext, (np.uint8,))
+    if image.dtype in dtypes:
+        return image
+    if np.issubdtype(image.dtype, np.floating) and np.float32 in dtypes:
+        return image.astype(np.float32)
+    integers = [d for d in dtypes if np.issubdtype(d, np.integer)]
+    return convert_depth(image, integers[-1])
+
+
+def preview_proxy(image):
+    """プレビュー用の8bit画像を返す（8bitの画像はそのまま返す）
+
+    画像を開いたときに一度だけ作り、プレビューの描画はすべてこれで行う。
+    整数型は型の最大値を白として線形に縮める。浮動小数は0〜1を基準とし、
+    1を超える値（HDR）があれば上位 HDR_WHITE_PERCENTILE % の値を白に合わせる。
+    アルファは型の値域のまま線形に縮める
+    """
+    import cv2
+
+    if image.dtype == np.uint8:
+        return image
+    white = dtype_max(image.dtype)
+    has_alpha = not is_opaque(image)
+    if np.issubdtype(image.dtype, np.floating):
+        image = np.nan_to_num(image)
+        np.maximum(image, 0, out=image)  # convertScaleAbs は負の値を反転するため
+        color = image[..., :3] if has_alpha else image
+        # 画素数によらず100万点程度を間引いて調べる
+        step = max(1, int(math.sqrt(color.shape[0] * color.shape[1] / 1e6)))
+        sample = color[::step, ::step]
+        if sample.max() > 1.0:
+            white = float(np.percentile(sample, HDR_WHITE_PERCENTILE))
+    proxy = cv2.convertScaleAbs(image, alpha=255.0 / white)
+    if has_alpha and white != dtype_max(image.dtype):
+        proxy[..., 3] = cv2.convertScaleAbs(image[..., 3], alpha=255.0 / dtype_max(image.dtype))
+    return proxy
+
+
+# ================================================================
+# ワープ
+# ================================================================
+
+# アルファチャンネルを保持できる出力形式
+ALPHA_FORMATS = ('png', 'webp', 'tif', 'tiff')
+
+
+def format_has_alpha(path_or_ext):
+    """出力形式（パスまたは拡張子）がアルファを保持できるか"""
+    ext = os.path.splitext(path_or_ext)[1] or path_or_ext
+    return ext.lower().lstrip('.') in ALPHA_FORMATS
+
+
+def is_opaque(src):
+    """アルファチャンネルを持たない（グレー/RGB）画像か"""
+    return src.ndim == 2 or src.shape[2] < 4
+
+
+def output_channels(src, alpha=True):
+    """warp_output が返す画像のチャンネル数"""
+    if alpha or not is_opaque(src):
+        return 4
+    return 1 if src.ndim == 2 else src.shape[2]
+
+
+def to_rgba(src):
+    """グレー/RGBをRGBAに変換（RGBAはそのまま）"""
+    import cv2
+
+    if src.ndim == 2:
+        return cv2.cvtColor(src, cv2.COLOR_GRAY2RGBA)
+    if src.shape[2] == 3:
+        return cv2.cvtColor(src, cv2.COLOR_RGB2RGBA)
+    return src
+
+
+def warp_rgba(src, matrix, out_w, out_h):
+    """RGBA変換して透明背景でワープ（cv2は初回呼び出し時に読み込む）"""
+    import cv2
+
+    return cv2.warpAffine(
+        to_rgba(src), matrix[:2, :],
+        (out_w, out_h),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=(0, 0, 0, 0))
+
+
+def warp_color(src, matrix, out_w, out_h, background=(0, 0, 0)):
+    """アルファを使わないワープ（外側は background で塗る）
+
+    グレーは1チャンネル、RGBは3チャンネルのままワープする
+    """
+    import cv2
+
+    return cv2.warpAffine(
+        src, matrix[:2, :],
+        (out_w, out_h),
+        flags=cv2.INTER_LINEAR,
+        borderMode=cv2.BORDER_CONSTANT,
+        borderValue=background)
+
+
+def coverage_mask(w, h, matrix, out_w, out_h):
+    """元画像の四角形を変換した領域の被覆率マスク（uint8）を解析的に求める
+
+    透明な境界とINTER_LINEARでワープしたときのアルファと同じく、画素中心の範囲
+    [0, w-1]×[0, h-1] の外側1画素で線形に減衰する縁を持つ。
+    各行で内側の区間は255で塗り、縁の帯の画素だけ被覆率を計算する
+    """
+    full = np.eye(3)
+    full[:2, :] = np.asarray(matrix, dtype=float)[:2, :]
+    inv = np.linalg.inv(full)  # 出力画素 → 元画像の座標
+    a, b, c = inv[0]
+    d, e, f = inv[1]
+    rows = np.arange(out_h, dtype=float)
+    px = b * rows + c   # 各行で sx = a * x + px
+    py = e * rows + f   # 各行で sy = d * x + py
+
+    def span(slope, offset, lo, hi):
+        # lo <= slope * x + offset <= hi を満たす x の区間（各行）
+        if abs(slope) < 1e-12:
+            inside = (offset >= lo) & (offset <= hi)
+            return np.where(inside, -np.inf, np.inf), np.where(inside, np.inf, -np.inf)
+        x0 = (lo - offset) / slope
+        x1 = (hi - offset) / slope
+        return np.minimum(x0, x1), np.maximum(x0, x1)
+
+    def pixel_range(lo_x, hi_x, lo_y, hi_y):
+        # 両方の条件を満たす整数画素の範囲 [start, stop]（出力内に制限）
+        sx0, sx1 = span(a, px, lo_x, hi_x)
+        sy0, sy1 = span(d, py, lo_y, hi_y)
+        start = np.clip(np.ceil(np.maximum(sx0, sy0)), 0, out_w)
+        stop = np.clip(np.floor(np.minimum(sx1, sy1)), -1, out_w - 1)
+        return start.astype(np.int64), stop.astype(np.int64)
+
+    outer0, outer1 = pixel_range(-1, w, -1, h)        # 被覆率 > 0 になりうる範囲
+    inner0, inner1 = pixel_range(0, w - 1, 0, h - 1)  # 被覆率 = 1 の範囲
+    inner0 = np.maximum(inner0, outer0)
+    inner1 = np.minimum(inner1, outer1)
+    empty = inner0 > inner1
+    inner0[empty] = outer1[empty] + 1
+    inner1[empty] = outer1[empty]
+
+    mask = np.zeros((out_h, out_w), dtype=np.uint8)
+    for y in np.nonzero(inner1 >= inner0)[0]:
+        mask[y, inner0[y]:inner1[y] + 1] = 255
+
+    # 縁の帯（内側の区間の左右）の画素をまとめて計算
+    band_rows = np.concatenate([np.arange(out_h), np.arange(out_h)])
+    starts = np.concatenate([outer0, inner1 + 1])
+    lengths = np.maximum(np.concatenate([inner0, outer1 + 1]) - starts, 0)
+    total = int(lengths.sum())
+    if total:
+        ys = np.repeat(band_rows, lengths)
+        first = np.cumsum(lengths) - lengths
+        xs = np.repeat(starts - first, lengths) + np.arange(total)
+        sx = a * xs + px[ys]
+        sy = d * xs + py[ys]
+        cover = (np.clip(np.minimum(sx + 1, w - sx), 0, 1) *
+                 np.clip(np.minimum(sy + 1, h - sy), 0, 1))
+        mask[ys, xs] = np.rint(cover * 255)
+    return mask
+
+
+def attach_alpha(color, mask):
+    """グレー/RGBのワープ結果に被覆率マスクをアルファとして付けたRGBAを返す
+
+    色は確保済みの4チャンネルのバッファへ cvtColor で書き、マスクは mixChannels で4番目にだけ書く
+    （merge のように全チャンネルを分解・再構成しない）
+    """
+    import cv2
+
+    if color.dtype != np.uint8:
+        # 8bit以外は型ごとの不透明値（整数は最大値、浮動小数は1.0）に合わせる
+        mask = (mask * (dtype_max(color.dtype) / 255.0)).astype(color.dtype)
+    out = np.empty(color.shape[:2] + (4,), dtype=color.dtype)
+    code = cv2.COLOR_GRAY2RGBA if color.ndim == 2 else cv2.COLOR_RGB2RGBA
+    cv2.cvtColor(color, code, dst=out)
+    cv2.mixChannels([mask], [out], [0, 3])
+    return out
+
+
+def warp_output(src, matrix, out_w, out_h, alpha=True):
+    """書き出し用のワープ（alpha=False ならアルファなしで返す）
+
+    グレー/RGBは元のチャンネル数のままワープし、アルファが必要なときだけ被覆率マスクから作る。
+    RGBAはアルファごとワープする
+    """
+    if not is_opaque(src):
+        return warp_rgba(src, matrix, out_w, out_h)
+    color = warp_color(src, matrix, out_w, out_h)
+    if not alpha:
+        return color
+    return attach_alpha(color, coverage_mask(src.shape[1], src.shape[0], matrix, out_w, out_h))
+
+
+def warp_preview(src, matrix, out_w, out_h, background=(0, 0, 0)):
+    """プレビュー用のワープ: 不透明な画像はアルファを使わず背景色の上に直接描く
+
+    background=None なら不透明な画像も透明な余白のRGBAで返す（下に描いたものを透かす場合）
+    """
+    if background is not None and is_opaque(src):
+        return warp_color(src, matrix, out_w, out_h, background)
+    return warp_rgba(src, matrix, out_w, out_h)
+
+
+def preview_channels(src, background=(0, 0, 0)):
+    """warp_preview が返す画像のチャンネル数"""
+    if background is not None and is_opaque(src):
+        return 1 if src.ndim == 2 else src.shape[2]
+    return 4
+
+
+def to_bgr(image):
+    """RGB/RGBAをcv2の書き出し用にBGR/BGRA順にする（グレーはそのまま）"""
+    import cv2
+
+    if image.ndim == 3:
+        if image.shape[2] == 4:
+            return cv2.cvtColor(image, cv2.COLOR_RGBA2BGRA)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+    return image
+
+
+# ================================================================
+# √対応の値パーサー
+# ================================================================
+
+def parse_expr(text):
+    """√対応の数式パーサー。例: √2, 1/√2, -√3/2, √2/2"""
+    text = text.strip()
+    if not text:
+        return 0.0
+    # √N → sqrt(N) に置換
+    text = re.sub(r'√(\d+\.?\d*)', r'sqrt(\1)', text)
+    # 安全な評価
+    allowed = {"__builtins__": {}, "sqrt": math.sqrt, "pi": math.pi}
+    return float(eval(text, allowed))
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+監視フォルダーの常駐変換（ヘッドレス）
+入力ディレクトリに置かれた画像へ保存済みの変換パイプライン（各変換の行列と適用順序）を適用し、
+出力ディレクトリへ書き出す。1つのプロセスで動き続けるため、cv2のimportは起動時の一度だけで済む
+
+- 上限付きキューと固定数のワーカー（キューが満杯の間は走査を止めるバックプレッシャー）
+- 出力は一時ファイルに書いてから os.replace で置き換える（書きかけのファイルを見せない）
+- キューの深さ・処理速度・p95レイテンシを一定間隔でメトリクスファイルに書き出す
+
+実行例:
+    python watch_folder.py in/ out/ --pipeline pipeline.json --workers 4 --metrics metrics.json
+"""
+
+import argparse
+import json
+import os
+import queue
+import signal
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+import image_cache
+import post_filters
+import transform_core
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_POLL_INTERVAL = 1.0      # 秒
+DEFAULT_METRICS_INTERVAL = 5.0   # 秒
+
+# 処理速度とp95レイテンシを集計する直近の件数
+METRICS_WINDOW = 1000
+
+
+# ================================================================
+# メトリクス
+# ================================================================
+
+class Metrics:
+    """処理件数と直近のレイテンシを集計する（ワーカーから並行に更新される）"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self._done = deque(maxlen=window)   # (完了時刻, 待ち込みのレイテンシ, 処理時間)
+        self.started = time.perf_counter()
+        self.processed = 0
+        self.failed = 0
+
+    def record(self, latency, busy):
+        with self._lock:
+            self._done.append((time.perf_counter(), latency, busy))
+            self.processed += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failed += 1
+
+    def snapshot(self, queue_depth):
+        with self._lock:
+            done = list(self._done)
+            processed, failed = self.processed, self.failed
+        now = time.perf_counter()
+
+        rate = 0.0
+        p95_latency = p95_busy = None
+        if done:
+            # 直近のウィンドウ内の完了件数から処理速度を求める（ウィンドウが埋まるまでは起動から）
+            since = done[0][0] if len(done) == self._done.maxlen else self.started
+            rate = len(done) / (now - since) if now > since else 0.0
+            p95_latency, p95_busy = np.percentile([[d[1], d[2]] for d in done], 95, axis=0)
+        return {
+            'time': time.time(),
+            'uptime_s': now - self.started,
+            'queue_depth': queue_depth,
+            'processed': processed,
+            'failed': failed,
+            'images_per_sec': rate,
+            'p95_latency_ms': None if p95_latency is None else float(p95_latency) * 1000.0,
+            'p95_process_ms': None if p95_busy is None else float(p95_busy) * 1000.0,
+        }
+
+
+def write_json_atomic(path, data):
+    """JSONを一時ファイルに書いてから置き換える"""
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# ================================================================
+# 監視と変換
+# ================================================================
+
+class WatchFolder:
+    """入力ディレクトリを走査し、上限付きキュー経由でワーカーに変換させる"""
+
+    def __init__(self, input_dir, output_dir, matrices, order=transform_core.DEFAULT_ORDER,
+                 workers=None, queue_size=DEFAULT_QUEUE_SIZE, out_format='png',
+                 poll_interval=DEFAULT_POLL_INTERVAL, metrics_path=None,
+                 metrics_interval=DEFAULT_METRICS_INTERVAL, filters=None, cache=None):
+        if os.path.abspath(input_dir) == os.path.abspath(output_dir):
+            raise ValueError("入力と出力に同じディレクトリは指定できません")
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.matrices = matrices
+        self.order = list(order)
+        self.filters = filters   # post_filters.FilterChain（Noneならフィルタなし）
+        self.cache = cache       # image_cache.ImageCache（Noneならキャッシュしない）
+        self.workers = workers or os.cpu_count()
+        self.out_format = out_format.lower().lstrip('.')
+        self.poll_interval = poll_interval
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.metrics = Metrics()
+        self.stop_event = threading.Event()
+        self._seen = {}       # 入力パス → 前回の走査で見た (サイズ, 更新時刻)
+        self._queued = set()  # 投入済みの (入力パス, 更新時刻)
+
+    def output_path(self, path):
+        stem = os.path.splitext(os.path.basename(path))[0]
+        return os.path.join(self.output_dir, f"{stem}.{self.out_format}")
+
+    # ---- 走査 ----
+
+    def scan(self):
+        """書き込みが終わった（2回の走査でサイズが変わらない）未処理の画像を古い順に返す"""
+        found = []
+        with os.scandir(self.input_dir) as it:
+            for entry in it:
+                if (entry.name.startswith('.') or not entry.is_file()
+                        or not entry.name.lower().endswith(IMAGE_EXTENSIONS)):
+                    continue
+                st = entry.stat()
+                found.append((st.st_mtime_ns, entry.path, st.st_size))
+
+        ready = []
+        seen = {}
+        for mtime, path, size in sorted(found):
+            seen[path] = (size, mtime)
+            if self._seen.get(path) != (size, mtime) or (path, mtime) in self._queued:
+                continue
+            # 再起動時: 入力より新しい出力があれば処理済み
+            out = self.output_path(path)
+            if os.path.exists(out) and os.stat(out).st_mtime_ns >= mtime:
+                continue
+            ready.append((path, mtime))
+        self._seen = seen
+        # 入力から消えたファイルの記録は捨てる（長時間の稼働でも増え続けないように）
+        self._queued = {(p, m) for p, m in self._queued if p in seen}
+        return ready
+
+    def _scan_loop(self, once):
+        while not self.stop_event.is_set():
+            for path, mtime in self.scan():
+                # キューが満杯の間はここで待つ（停止要求は定期的に確認）
+                while not self.stop_event.is_set():
+                    try:
+                        self.queue.put((path, time.perf_counter()), timeout=0.5)
+                        self._queued.add((path, mtime))
+                        break
+                    except queue.Full:
+                        continue
+            if once and not self._seen_pending():
+                break
+            self.stop_event.wait(self.poll_interval)
+
+    def _seen_pending(self):
+        """once モード: 走査で見つかったがまだ安定を確認していないファイルがあるか"""
+        return any((p, m) not in self._queued and not self._is_done(p, m)
+                   for p, (_, m) in self._seen.items())
+
+    def _is_done(self, path, mtime):
+        out = self.output_path(path)
+        return os.path.exists(out) and os.stat(out).st_mtime_ns >= mtime
+
+    # ---- 変換 ----
+
+    def process(self, path):
+        """1枚を変換して出力ディレクトリへアトミックに書き出す"""
+        import cv2
+
+        image = image_cache.read_image(path, self.cache)
+        h, w = image.shape[:2]
+        matrix, out_w, out_h = transform_core.build_transform(w, h, self.matrices, self.order)
+        alpha = transform_core.format_has_alpha(self.out_format)
+        out = transform_core.to_bgr(
+            post_filters.render_output(image, matrix, out_w, out_h, self.filters, alpha))
+        if not alpha and out.ndim == 3 and out.shape[2] == 4:
+            out = cv2.cvtColor(out, cv2.COLOR_BGRA2BGR)
+        out = transform_core.fit_format_depth(out, self.out_format)
+        ok, buf = cv2.imencode('.' + self.out_format, out)
+        if not ok:
+            raise ValueError(f"エンコードに失敗しました: {self.out_format}")
+
+        dst = self.output_path(path)
+        tmp = os.path.join(self.output_dir,
+                           f".{os.path.basename(dst)}.tmp-{os.getpid()}-{threading.get_ident()}")
+        with open(tmp, 'wb') as f:
+            f.write(buf)
+        os.replace(tmp, dst)
+        return dst
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            path, enqueued = item
+            t0 = time.perf_counter()
+            try:
+                self.process(path)
+                t1 = time.perf_counter()
+                self.metrics.record(t1 - enqueued, t1 - t0)
+            except Exception as e:
+                self.metrics.record_failure()
+                print(f"変換失敗: {path}: {e}")
+            finally:
+                self.queue.task_done()
+
+    # ---- メトリクス ----
+
+    def write_metrics(self):
+        if self.metrics_path:
+            write_json_atomic(self.metrics_path, self.metrics.snapshot(self.queue.qsize()))
+
+    def _metrics_loop(self):
+        while not self.stop_event.wait(self.metrics_interval):
+            self.write_metrics()
+
+    # ---- 実行 ----
+
+    def run(self, once=False):
+        """停止要求（SIGINT/SIGTERM）まで監視を続ける。once=True なら既存のファイルを処理して終了"""
+        import cv2  # noqa: F401  起動時に一度だけ読み込む
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        workers = [threading.Thread(target=self._worker, daemon=True)
+                   for _ in range(self.workers)]
+        for t in workers:
+            t.start()
+        metrics_thread = threading.Thread(target=self._metrics_loop, daemon=True)
+        metrics_thread.start()
+
+        try:
+            self._scan_loop(once)
+        finally:
+            # 投入済みの画像を処理し終えてからワーカーを止める
+            for _ in workers:
+                self.queue.put(None)
+            for t in workers:
+                t.join()
+            self.stop_event.set()
+            self.write_metrics()
+
+    def stop(self, *args):
+        self.stop_event.set()
+
+
+# ================================================================
+# コマンドライン
+# ================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="監視フォルダーの画像に変換パイプラインを適用し続ける")
+    parser.add_argument('input_dir', help="監視する入力ディレクトリ")
+    parser.add_argument('output_dir', help="出力ディレクトリ")
+    parser.add_argument('--pipeline', required=True,
+                        help="変換パイプライン（GUIの「パイプラインを保存」で作成したJSON）")
+    parser.add_argument('--workers', type=int, help="ワーカー数（既定: CPU数）")
+    parser.add_argument('--queue-size', type=int, default=DEFAULT_QUEUE_SIZE,
+                        help="キューの上限（満杯の間は走査を止める）")
+    parser.add_argument('--format', default='png', help="出力形式（拡張子）")
+    parser.add_argument('--filters', metavar='SPEC',
+                        help="後処理フィルタ（例: sharpen:amount=0.8,gamma:2.2。パイプラインの指定より優先）")
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        metavar='SEC', help="入力ディレクトリの走査間隔")
+    parser.add_argument('--metrics', help="メトリクスを書き出すJSONファイル")
+    parser.add_argument('--metrics-interval', type=float, default=DEFAULT_METRICS_INTERVAL,
+                        metavar='SEC', help="メトリクスの書き出し間隔")
+    parser.add_argument('--once', action='store_true',
+                        help="既存のファイルを処理したら終了する")
+    image_cache.add_arguments(parser)
+    args = parser.parse_args()
+
+    matrices, order, filters = transform_core.load_pipeline(args.pipeline)
+    try:
+        chain = post_filters.parse_chain(args.filters if args.filters is not None else filters)
+    except (ValueError, TypeError) as e:
+        raise SystemExit(f"フィルタの指定が正しくありません: {e}")
+    daemon = WatchFolder(args.input_dir, args.output_dir, matrices, order,
+                         workers=args.workers, queue_size=args.queue_size,
+                         out_format=args.format, poll_interval=args.poll_interval,
+                         metrics_path=args.metrics, metrics_interval=args.metrics_interval,
+                         filters=chain, cache=image_cache.from_args(args))
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+
+    print(f"監視中: {args.input_dir} → {args.output_dir}（Ctrl+C で停止）")
+    daemon.run(once=args.once)
+    m = daemon.metrics
+    print(f"処理 {m.processed} 件 / 失敗 {m.failed} 件")
+
+
+if __name__ == "__main__":
+    main()